@@ -2,39 +2,217 @@ import os
 import time
 import json
 import base64
-import torch
+import threading
+from collections import Counter
+from contextlib import contextmanager
 from PIL import Image
-from transformers import BlipProcessor, BlipForConditionalGeneration
-from sentence_transformers import SentenceTransformer
-import easyocr
 import numpy as np
-import google.generativeai as genai
-from openai import OpenAI
+from app.core import config
+
+# torch, transformers, sentence_transformers and easyocr are imported when a model is
+# first loaded, and provider SDKs when that provider is used, so importing this module
+# (and starting the API) stays fast.
+
+# Zero-shot prompts used to decide whether an image is worth running OCR on
+TEXT_PROMPTS = [
+    "a photo of a document",
+    "a scanned receipt",
+    "a screenshot with text",
+    "a sign with words on it",
+    "a page of printed text",
+    "handwritten notes",
+]
+NO_TEXT_PROMPTS = [
+    "a photo of an animal",
+    "a photo of a landscape",
+    "a photo of a car",
+    "a photo of a person",
+    "a photo of an object",
+    "a photo of food",
+]
+
+
+TEXT_STOP_WORDS = {'the', 'and', 'this', 'that', 'with', 'from', 'image', 'picture', 'photo', 'about', 'there', 'their'}
+# Characters read from a text file at a time
+TEXT_READ_BLOCK = 64 * 1024
+
+
+def _chunk_text(blocks, size, overlap):
+    """Split a stream of text blocks into chunks of at most `size` characters.
+
+    Consecutive chunks overlap by up to `overlap` characters and break on whitespace
+    where possible. Yields (chunk, new) where chunk[new:] is the text not already
+    part of the previous chunk.
+    """
+    buf = ""
+    carried = 0
+    for block in blocks:
+        buf += block
+        while len(buf) >= size:
+            cut = max(buf.rfind(" ", size // 2, size), buf.rfind("\n", size // 2, size))
+            if cut <= carried:
+                cut = size
+            yield buf[:cut], carried
+            start = max(cut - overlap, 0)
+            buf = buf[start:]
+            carried = cut - start
+    if len(buf) > carried and buf[carried:].strip():
+        yield buf, carried
+
+
+def _downscale(image, max_side):
+    if max(image.size) <= max_side:
+        return image
+    scale = max_side / max(image.size)
+    return image.resize((max(1, int(image.width * scale)), max(1, int(image.height * scale))))
+
 
 class ImageAnalyzer:
     def __init__(self):
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self._device = None
         self.clip_model = None
         self.blip_processor = None
         self.blip_model = None
         self.reader = None
+        # One lock per model so loading one does not block users of another
+        self._locks = {"clip": threading.Lock(), "blip": threading.Lock(), "ocr": threading.Lock()}
+        self._prompt_embeddings = None
+        # Per-thread stage timings for the analyze() call in progress
+        self._local = threading.local()
+
+    @property
+    def device(self):
+        if self._device is None:
+            import torch
+            if config.TORCH_THREADS:
+                torch.set_num_threads(config.TORCH_THREADS)
+            self._device = "cuda" if torch.cuda.is_available() else "cpu"
+        return self._device
 
     def _load_models(self):
-        if self.clip_model is not None:
-            return
+        """Load every local model. Analysis paths load only the models they need."""
+        self._get_clip()
+        self._get_blip()
+        self._get_reader()
 
-        print(f"Loading models on {self.device}...")
-        
-        # Load CLIP for embeddings
-        self.clip_model = SentenceTransformer('clip-ViT-B-32')
-        
-        # Load BLIP for captioning
-        self.blip_processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
-        self.blip_model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base").to(self.device)
-        
-        # Load EasyOCR
-        self.reader = easyocr.Reader(['en'], gpu=(self.device == "cuda"))
-        print("Models loaded.")
+    def _quantize(self, model):
+        if config.QUANTIZE == "int8" and self.device == "cpu":
+            import torch
+            # Dynamic int8 quantization of the Linear layers, which dominate CPU inference time
+            return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        return model
+
+    def _get_clip(self):
+        if self.clip_model is None:
+            with self._locks["clip"]:
+                if self.clip_model is None:
+                    from sentence_transformers import SentenceTransformer
+                    print(f"Loading CLIP ({config.CLIP_MODEL}) on {self.device}...")
+                    with self._stage("model_load"):
+                        model = SentenceTransformer(config.CLIP_MODEL, device=self.device)
+                        model.eval()
+                        self.clip_model = self._quantize(model)
+        return self.clip_model
+
+    def _get_blip(self):
+        if self.blip_model is None:
+            with self._locks["blip"]:
+                if self.blip_model is None:
+                    from transformers import BlipProcessor, BlipForConditionalGeneration
+                    print(f"Loading BLIP ({config.BLIP_MODEL}) on {self.device}...")
+                    with self._stage("model_load"):
+                        self.blip_processor = BlipProcessor.from_pretrained(config.BLIP_MODEL)
+                        model = BlipForConditionalGeneration.from_pretrained(config.BLIP_MODEL).to(self.device)
+                        model.eval()
+                        self.blip_model = self._quantize(model)
+        return self.blip_processor, self.blip_model
+
+    def _get_reader(self):
+        if self.reader is None:
+            with self._locks["ocr"]:
+                if self.reader is None:
+                    import easyocr
+                    print(f"Loading EasyOCR ({','.join(config.OCR_LANGUAGES)})...")
+                    with self._stage("model_load"):
+                        self.reader = easyocr.Reader(config.OCR_LANGUAGES, gpu=(self.device == "cuda"))
+        return self.reader
+
+    def warm_up(self):
+        """Load all local models and run each once so the first scanned file is not slow."""
+        start_time = time.perf_counter()
+        try:
+            image = Image.new('RGB', (64, 64), color='white')
+            self._text_score(self._get_clip().encode(image))
+            self._caption(image)
+            self._get_reader().readtext(np.array(image), detail=0)
+            print(f"Models warmed up in {time.perf_counter() - start_time:.1f}s")
+        except Exception as e:
+            print(f"Model warm-up failed: {e}")
+
+    def _text_score(self, embedding):
+        """Zero-shot CLIP probability that the image contains readable text."""
+        if self._prompt_embeddings is None:
+            self._prompt_embeddings = self._get_clip().encode(
+                TEXT_PROMPTS + NO_TEXT_PROMPTS, normalize_embeddings=True
+            )
+        emb = np.asarray(embedding, dtype=np.float32)
+        emb = emb / (np.linalg.norm(emb) or 1.0)
+        # 100 is CLIP's logit scale
+        logits = 100.0 * (self._prompt_embeddings @ emb)
+        probs = np.exp(logits - logits.max())
+        probs /= probs.sum()
+        return float(probs[:len(TEXT_PROMPTS)].sum())
+
+    def _extract_text(self, image_path, image=None, embedding=None):
+        """Run OCR on the image unless the configured pre-check finds no text."""
+        if image is None:
+            image = Image.open(image_path)
+        image = image.convert('RGB')
+
+        with self._stage("ocr_gate"):
+            if config.OCR_GATE == "clip" and embedding is not None:
+                has_text = self._text_score(embedding) >= config.OCR_TEXT_THRESHOLD
+            elif config.OCR_GATE == "detector":
+                # Detection alone on a small copy is far cheaper than detection + recognition
+                horizontal, free = self._get_reader().detect(np.array(_downscale(image, 640)))
+                has_text = bool(horizontal[0] or free[0])
+            else:
+                has_text = True
+        if not has_text:
+            self._local.ocr_skipped = True
+            return ""
+
+        with self._stage("ocr"):
+            if config.OCR_MAX_SIDE:
+                ocr_input = np.array(_downscale(image, config.OCR_MAX_SIDE))
+            else:
+                ocr_input = image_path
+            return " ".join(self._get_reader().readtext(ocr_input, detail=0))
+
+    def _caption(self, image):
+        processor, model = self._get_blip()
+        with self._stage("blip"):
+            import torch
+            inputs = processor(image, return_tensors="pt").to(self.device)
+            with torch.inference_mode():
+                out = model.generate(**inputs, max_new_tokens=50)
+            return processor.decode(out[0], skip_special_tokens=True)
+
+    def _encode(self, content, **kwargs):
+        clip = self._get_clip()
+        with self._stage("clip"):
+            return clip.encode(content, **kwargs)
+
+    @contextmanager
+    def _stage(self, name):
+        """Time a pipeline stage into the per-call breakdown returned in result metadata."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stages = getattr(self._local, "stages", None)
+            if stages is not None:
+                stages[name] = stages.get(name, 0.0) + time.perf_counter() - start
 
     def analyze_with_llm(self, image_path: str, api_key: str, model_id: str = "gemini-1.5-flash-latest"):
         if not api_key:
@@ -42,13 +220,15 @@ class ImageAnalyzer:
             
         start_time = time.perf_counter()
         try:
+            import google.generativeai as genai
             genai.configure(api_key=api_key)
             model = genai.GenerativeModel(model_id)
             
             img = Image.open(image_path)
             prompt = "Analyze this image and provide: 1. A detailed caption. 2. A list of key entities/concepts found in the image. Format as JSON with 'caption' and 'tags' keys."
             
-            response = model.generate_content([prompt, img])
+            with self._stage("llm"):
+                response = model.generate_content([prompt, img])
             # Basic parsing of JSON from response text
             text = response.text
             # Simple cleanup if LLM wraps in code blocks
@@ -60,12 +240,10 @@ class ImageAnalyzer:
             data = json.loads(text)
             
             # We still need CLIP embedding for graph similarity
-            self._load_models() # Ensure clip is loaded
-            embedding = self.clip_model.encode(img)
+            embedding = self._encode(img)
             
             # OCR is optional if we have LLM, but let's keep it for precision
-            ocr_result = self.reader.readtext(image_path, detail=0)
-            ocr_text = " ".join(ocr_result)
+            ocr_text = self._extract_text(image_path, img, embedding)
             
             duration = time.perf_counter() - start_time
             return {
@@ -86,6 +264,7 @@ class ImageAnalyzer:
             
         start_time = time.perf_counter()
         try:
+            from openai import OpenAI
             client = OpenAI(api_key=api_key)
             
             with open(image_path, "rb") as image_file:
@@ -93,36 +272,35 @@ class ImageAnalyzer:
             
             prompt = "Analyze this image and provide: 1. A detailed caption. 2. A list of key entities/concepts found in the image. Format as JSON with 'caption' and 'tags' keys. Do not include markdown formatting like ```json."
             
-            response = client.chat.completions.create(
-                model=model_id,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}"
+            with self._stage("llm"):
+                response = client.chat.completions.create(
+                    model=model_id,
+                    messages=[
+                        {
+                            "role": "user",
+                            "content": [
+                                {"type": "text", "text": prompt},
+                                {
+                                    "type": "image_url",
+                                    "image_url": {
+                                        "url": f"data:image/jpeg;base64,{base64_image}"
+                                    }
                                 }
-                            }
-                        ]
-                    }
-                ],
-                max_tokens=500,
-                response_format={"type": "json_object"}
-            )
+                            ]
+                        }
+                    ],
+                    max_tokens=500,
+                    response_format={"type": "json_object"}
+                )
             
             text = response.choices[0].message.content
             data = json.loads(text)
             
             # Use local models for embedding and OCR
-            self._load_models()
             img = Image.open(image_path)
-            embedding = self.clip_model.encode(img)
+            embedding = self._encode(img)
             
-            ocr_result = self.reader.readtext(image_path, detail=0)
-            ocr_text = " ".join(ocr_result)
+            ocr_text = self._extract_text(image_path, img, embedding)
             
             duration = time.perf_counter() - start_time
             return {
@@ -141,6 +319,7 @@ class ImageAnalyzer:
         start_time = time.perf_counter()
         try:
             # LM Studio is OpenAI compatible
+            from openai import OpenAI
             client = OpenAI(api_key="lm-studio", base_url=base_url)
             
             with open(image_path, "rb") as image_file:
@@ -148,24 +327,25 @@ class ImageAnalyzer:
             
             prompt = "Analyze this image and provide: 1. A detailed caption. 2. A list of key entities/concepts found in the image. Format as JSON with 'caption' and 'tags' keys. Do not include markdown formatting like ```json."
             
-            response = client.chat.completions.create(
-                model=model_id,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}"
+            with self._stage("llm"):
+                response = client.chat.completions.create(
+                    model=model_id,
+                    messages=[
+                        {
+                            "role": "user",
+                            "content": [
+                                {"type": "text", "text": prompt},
+                                {
+                                    "type": "image_url",
+                                    "image_url": {
+                                        "url": f"data:image/jpeg;base64,{base64_image}"
+                                    }
                                 }
-                            }
-                        ]
-                    }
-                ],
-                max_tokens=500
-            )
+                            ]
+                        }
+                    ],
+                    max_tokens=500
+                )
             
             text = response.choices[0].message.content
             # LM Studio might not support response_format="json_object" depending on the model, 
@@ -177,12 +357,10 @@ class ImageAnalyzer:
             
             data = json.loads(text)
             
-            self._load_models()
             img = Image.open(image_path)
-            embedding = self.clip_model.encode(img)
+            embedding = self._encode(img)
             
-            ocr_result = self.reader.readtext(image_path, detail=0)
-            ocr_text = " ".join(ocr_result)
+            ocr_text = self._extract_text(image_path, img, embedding)
             
             duration = time.perf_counter() - start_time
             return {
@@ -200,9 +378,8 @@ class ImageAnalyzer:
     def analyze_text(self, file_path: str, use_llm=False, api_key="", model_id="gemini-1.5-flash-latest", provider="gemini", base_url=""):
         start_time = time.perf_counter()
         try:
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                content = f.read()
-        except Exception as e:
+            content, embedding, words = self._read_text(file_path)
+        except OSError as e:
             print(f"Error reading text file {file_path}: {e}")
             return None
 
@@ -217,8 +394,6 @@ class ImageAnalyzer:
                 res = self._analyze_text_gemini(summary_text, api_key, model_id)
             
             if res and "error" not in res:
-                self._load_models()
-                embedding = self.clip_model.encode(summary_text[:500])
                 duration = time.perf_counter() - start_time
                 return {
                     "caption": res.get("summary", ""),
@@ -230,13 +405,8 @@ class ImageAnalyzer:
             elif res and "error" in res:
                 return res
 
-        # Fallback / Local Analysis
-        self._load_models()
-        embedding = self.clip_model.encode(summary_text[:500])
-        
-        words = [w.strip(".,!?;:()[]{}").lower() for w in summary_text[:500].split() if len(w) > 4]
-        stop_words = {'the', 'and', 'this', 'that', 'with', 'from', 'image', 'picture', 'photo', 'about', 'there', 'their'}
-        tags = list(set([w for w in words if w not in stop_words]))[:10]
+        # Fallback / Local Analysis: the most frequent words across the whole file
+        tags = [w for w, _ in words.most_common(10)]
 
         duration = time.perf_counter() - start_time
         return {
@@ -247,12 +417,69 @@ class ImageAnalyzer:
             "metadata": {"duration": duration, "method": "Local Text Analysis"}
         }
 
+    def _read_text(self, file_path):
+        """Stream a text file in overlapping chunks and embed them in batches.
+
+        Returns the start of the file (up to TEXT_STORE_CHARS), the length-weighted mean
+        of the normalized chunk embeddings and a word count over the whole file. Only one
+        batch of chunks is held at a time, so memory stays flat for very large files.
+        """
+        size = config.TEXT_CHUNK_CHARS
+        overlap = min(config.TEXT_CHUNK_OVERLAP, size // 4)
+        # Embed only every n-th chunk of very large files to bound encode time
+        estimated = os.path.getsize(file_path) // max(size - overlap, 1) + 1
+        stride = -(-estimated // config.TEXT_MAX_CHUNKS) if config.TEXT_MAX_CHUNKS else 1
+
+        head = []
+        stored = 0
+        words = Counter()
+        batch = []
+        pooled = None
+
+        def flush():
+            nonlocal pooled
+            vectors = np.asarray(self._encode(batch, batch_size=config.TEXT_BATCH_SIZE), dtype=np.float32)
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+            weights = np.array([len(c) for c in batch], dtype=np.float32)
+            total = weights @ vectors
+            pooled = total if pooled is None else pooled + total
+            batch.clear()
+
+        def blocks(f):
+            while True:
+                with self._stage("read"):
+                    block = f.read(TEXT_READ_BLOCK)
+                if not block:
+                    return
+                yield block
+
+        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+            for i, (chunk, new) in enumerate(_chunk_text(blocks(f), size, overlap)):
+                text = chunk[new:]
+                if stored < config.TEXT_STORE_CHARS:
+                    head.append(text[:config.TEXT_STORE_CHARS - stored])
+                    stored += len(head[-1])
+                words.update(w for w in (w.strip(".,!?;:()[]{}\"'").lower() for w in text.split())
+                             if len(w) > 4 and w not in TEXT_STOP_WORDS)
+                if i % stride == 0:
+                    batch.append(chunk)
+                    if len(batch) >= config.TEXT_BATCH_SIZE:
+                        flush()
+        if batch:
+            flush()
+
+        content = "".join(head)
+        embedding = pooled / np.linalg.norm(pooled) if pooled is not None else self._encode(content)
+        return content, embedding, words
+
     def _analyze_text_gemini(self, text, api_key, model_id):
         try:
+            import google.generativeai as genai
             genai.configure(api_key=api_key)
             model = genai.GenerativeModel(model_id)
             prompt = f"Summarize this text in 100 chars and extract 5-10 keywords as JSON with 'summary' and 'tags' keys:\n\n{text}"
-            response = model.generate_content(prompt)
+            with self._stage("llm"):
+                response = model.generate_content(prompt)
             res_text = response.text
             if "```json" in res_text:
                 res_text = res_text.split("```json")[1].split("```")[0]
@@ -264,27 +491,31 @@ class ImageAnalyzer:
 
     def _analyze_text_openai(self, text, api_key, model_id):
         try:
+            from openai import OpenAI
             client = OpenAI(api_key=api_key)
             prompt = f"Summarize this text in 100 chars and extract 5-10 keywords as JSON with 'summary' and 'tags' keys:\n\n{text}"
-            response = client.chat.completions.create(
-                model=model_id,
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=200,
-                response_format={"type": "json_object"}
-            )
+            with self._stage("llm"):
+                response = client.chat.completions.create(
+                    model=model_id,
+                    messages=[{"role": "user", "content": prompt}],
+                    max_tokens=200,
+                    response_format={"type": "json_object"}
+                )
             return json.loads(response.choices[0].message.content)
         except Exception as e:
             return {"error": str(e)}
 
     def _analyze_text_lmstudio(self, text, model_id, base_url="http://localhost:1234/v1"):
         try:
+            from openai import OpenAI
             client = OpenAI(api_key="lm-studio", base_url=base_url)
             prompt = f"Summarize this text in 100 chars and extract 5-10 keywords as JSON with 'summary' and 'tags' keys:\n\n{text}"
-            response = client.chat.completions.create(
-                model=model_id,
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=200
-            )
+            with self._stage("llm"):
+                response = client.chat.completions.create(
+                    model=model_id,
+                    messages=[{"role": "user", "content": prompt}],
+                    max_tokens=200
+                )
             res_text = response.choices[0].message.content
             if "```json" in res_text:
                 res_text = res_text.split("```json")[1].split("```")[0]
@@ -295,6 +526,21 @@ class ImageAnalyzer:
             return {"error": str(e)}
 
     def analyze(self, file_path: str, use_llm=False, api_key="", model_id="gemini-1.5-flash-latest", provider="gemini", base_url=""):
+        """Analyze an image or text file. metadata["stages"] breaks the time down per stage."""
+        self._local.stages = {}
+        self._local.ocr_skipped = False
+        try:
+            result = self._analyze(file_path, use_llm, api_key, model_id, provider, base_url)
+        finally:
+            stages = self._local.stages
+            self._local.stages = None
+        if result:
+            metadata = result.setdefault("metadata", {})
+            metadata["stages"] = stages
+            metadata["ocr_skipped"] = self._local.ocr_skipped
+        return result
+
+    def _analyze(self, file_path: str, use_llm=False, api_key="", model_id="gemini-1.5-flash-latest", provider="gemini", base_url=""):
         ext = os.path.splitext(file_path)[1].lower()
         if ext == '.txt':
             return self.analyze_text(file_path, use_llm, api_key, model_id, provider, base_url)
@@ -314,24 +560,21 @@ class ImageAnalyzer:
                 # Propagate error so worker can log it before fallback
                 return res
             
-        self._load_models()
         try:
-            image = Image.open(file_path).convert('RGB')
+            with self._stage("decode"):
+                image = Image.open(file_path).convert('RGB')
         except Exception as e:
             print(f"Error opening image {file_path}: {e}")
             return None
 
         # 1. Generate Caption
-        inputs = self.blip_processor(image, return_tensors="pt").to(self.device)
-        out = self.blip_model.generate(**inputs, max_new_tokens=50)
-        caption = self.blip_processor.decode(out[0], skip_special_tokens=True)
+        caption = self._caption(image)
 
-        # 2. Extract OCR
-        ocr_result = self.reader.readtext(file_path, detail=0)
-        ocr_text = " ".join(ocr_result)
+        # 2. Generate Embedding
+        embedding = self._encode(image)
 
-        # 3. Generate Embedding
-        embedding = self.clip_model.encode(image)
+        # 3. Extract OCR (the embedding tells us whether there is any text to read)
+        ocr_text = self._extract_text(file_path, image, embedding)
         
         duration = time.perf_counter() - start_time
         return {
@@ -0,0 +1,82 @@
+import os
+
+# Runtime settings, read from IMAGEGRAPH_* environment variables.
+
+
+def _env_bool(name, default=False):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# "viewer" only serves the graph, thumbnails and search; scanning, watching and model
+# loading are disabled, so torch and the other ML libraries are never imported
+MODE = os.environ.get("IMAGEGRAPH_MODE", "full").lower()
+
+# Model variants (any SentenceTransformer CLIP / HuggingFace BLIP checkpoint)
+CLIP_MODEL = os.environ.get("IMAGEGRAPH_CLIP_MODEL", "clip-ViT-B-32")
+BLIP_MODEL = os.environ.get("IMAGEGRAPH_BLIP_MODEL", "Salesforce/blip-image-captioning-base")
+OCR_LANGUAGES = os.environ.get("IMAGEGRAPH_OCR_LANGUAGES", "en").split(",")
+
+# "int8" applies dynamic int8 quantization to BLIP and CLIP when running on CPU
+QUANTIZE = os.environ.get("IMAGEGRAPH_QUANTIZE", "none").lower()
+
+# Load (and run once) all local models in the background when the server starts
+WARMUP = _env_bool("IMAGEGRAPH_WARMUP")
+
+# Number of inference processes; 0 runs the models inside the API process
+INFERENCE_WORKERS = int(os.environ.get("IMAGEGRAPH_INFERENCE_WORKERS", "0"))
+# torch intra-op threads per inference process (0 = split the CPU cores between workers)
+TORCH_THREADS = int(os.environ.get("IMAGEGRAPH_TORCH_THREADS", "0"))
+
+# Pre-check that decides whether an image gets full OCR:
+#   "clip"     - zero-shot "contains text" score from the CLIP embedding (no extra model pass)
+#   "detector" - EasyOCR text detection alone on a downscaled copy
+#   "off"      - always run OCR
+OCR_GATE = os.environ.get("IMAGEGRAPH_OCR_GATE", "clip").lower()
+OCR_TEXT_THRESHOLD = float(os.environ.get("IMAGEGRAPH_OCR_TEXT_THRESHOLD", "0.3"))
+# Downscale images so their longest side is at most this many pixels before OCR (0 = full size)
+OCR_MAX_SIDE = int(os.environ.get("IMAGEGRAPH_OCR_MAX_SIDE", "0"))
+
+# Text files are streamed in overlapping chunks sized for CLIP's 77-token text encoder,
+# embedded in batches and mean-pooled into one vector per file
+TEXT_CHUNK_CHARS = int(os.environ.get("IMAGEGRAPH_TEXT_CHUNK_CHARS", "300"))
+TEXT_CHUNK_OVERLAP = int(os.environ.get("IMAGEGRAPH_TEXT_CHUNK_OVERLAP", "50"))
+TEXT_BATCH_SIZE = int(os.environ.get("IMAGEGRAPH_TEXT_BATCH_SIZE", "32"))
+# Embed at most this many evenly spaced chunks per file (0 = every chunk)
+TEXT_MAX_CHUNKS = int(os.environ.get("IMAGEGRAPH_TEXT_MAX_CHUNKS", "2000"))
+# Characters of each text file kept in the database for display
+TEXT_STORE_CHARS = int(os.environ.get("IMAGEGRAPH_TEXT_STORE_CHARS", "100000"))
+
+# Where per-scan cProfile dumps (POST /scan with "profile": true) are written
+PROFILE_DIR = os.environ.get(
+    "IMAGEGRAPH_PROFILE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "profiles")
+)
+
+# Server-side graph layout (GET /graph?layout=true)
+LAYOUT_ITERATIONS = int(os.environ.get("IMAGEGRAPH_LAYOUT_ITERATIONS", "50"))
+# Above this many nodes the force-directed pass is skipped and the CLIP projection is used as is
+LAYOUT_MAX_NODES = int(os.environ.get("IMAGEGRAPH_LAYOUT_MAX_NODES", "5000"))
+# Recompute the full layout once this fraction of nodes has been placed incrementally
+LAYOUT_REFRESH = float(os.environ.get("IMAGEGRAPH_LAYOUT_REFRESH", "0.2"))
+# Communities smaller than this stay expanded in GET /graph?collapse=true
+CLUSTER_MIN_SIZE = int(os.environ.get("IMAGEGRAPH_CLUSTER_MIN_SIZE", "5"))
+
+# Named libraries other than "default" are stored as <name>.sqlite in this folder
+LIBRARY_DIR = os.environ.get(
+    "IMAGEGRAPH_LIBRARY_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "libraries")
+)
+
+# Embedding storage format: "float32" (raw), or pre-normalized "float16" / "int8" (2x / 4x smaller).
+# Rows keep the format they were written in, so this can be changed without a rescan
+VECTOR_FORMAT = os.environ.get("IMAGEGRAPH_VECTOR_FORMAT", "float32").lower()
+# Format of the in-memory vectors used for similarity and search (defaults to the storage format)
+VECTOR_INDEX_FORMAT = os.environ.get("IMAGEGRAPH_VECTOR_INDEX_FORMAT", VECTOR_FORMAT).lower()
+# Reduce in-memory vectors to this many PCA dimensions for similarity (0 = full size)
+VECTOR_DIM = int(os.environ.get("IMAGEGRAPH_VECTOR_DIM", "0"))
+# With compact or reduced vectors, pairs scoring within this margin below the similarity
+# threshold are re-checked against the full stored vectors in float32
+VECTOR_RERANK_MARGIN = float(os.environ.get("IMAGEGRAPH_VECTOR_RERANK_MARGIN", "0.05"))
@@ -0,0 +1,53 @@
+import asyncio
+import json
+import threading
+
+
+class EventBus:
+    """Fans out server events (progress, log lines, graph deltas) to /events subscribers.
+
+    Publishers are plain threads (scan workers, the folder watcher); each subscriber
+    is an asyncio queue owned by one streaming response.
+    """
+
+    def __init__(self, max_queue=1000):
+        self.max_queue = max_queue
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        sub = (asyncio.get_running_loop(), asyncio.Queue(self.max_queue))
+        with self._lock:
+            self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def publish(self, event_type, data):
+        message = (event_type, data)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for loop, q in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._put, q, message)
+            except RuntimeError:
+                # Event loop already closed
+                self.unsubscribe((loop, q))
+
+    @staticmethod
+    def _put(q, message):
+        try:
+            q.put_nowait(message)
+        except asyncio.QueueFull:
+            # A slow client missed events; tell it to refetch instead of replaying them
+            while not q.empty():
+                q.get_nowait()
+            q.put_nowait(("resync", {}))
+
+    @staticmethod
+    def format_sse(event_type, data):
+        return f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
+
+event_bus = EventBus()
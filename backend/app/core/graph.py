@@ -1,24 +1,102 @@
 import networkx as nx
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 from app.db.storage import db
+from app.core.events import event_bus
+from app.core.layout import GraphLayout
+from app.core.metrics import metrics
+from app.core.vectors import VectorIndex, normalize, rerank
+from app.core import config
+from collections import defaultdict
 import json
 import os
+import threading
+import time
 
 class GraphBuilder:
-    def __init__(self, sim_threshold=0.7, min_confidence=0.5):
+    def __init__(self, sim_threshold=0.7, min_confidence=0.5, storage=None, library="default"):
+        self.db = storage or db
+        # Name of the library this graph belongs to, sent with every event
+        self.library = library
         self.sim_threshold = sim_threshold
         self.min_confidence = min_confidence
         self._cached_graph = None
         self._cache_valid = False
         self._last_image_count = 0
+        # Bumped on every change to the cached graph
+        self.version = 0
+        # State kept alongside the cached graph so single items can be patched in/out
+        self._item_concepts = {}
+        # Compact vectors of this library, also used for similarity search
+        self.index = VectorIndex(self.db)
+        self.layout = GraphLayout()
+        self._lock = threading.RLock()
 
     def invalidate_cache(self):
         """Call this when new images are added."""
         self._cache_valid = False
 
+    def set_sim_threshold(self, sim_threshold):
+        with self._lock:
+            if sim_threshold != self.sim_threshold:
+                self.sim_threshold = sim_threshold
+                self.invalidate_cache()
+
+    @staticmethod
+    def _concepts_for(tags):
+        return [f"con_{t.lower().strip()}" for t in tags if len(t.lower().strip()) >= 2]
+
+    def _add_item_node(self, G, img):
+        iid, path, caption, tags_json, item_type = img
+        node_id = f"img_{iid}"
+        
+        tags = json.loads(tags_json) if tags_json else []
+        
+        G.add_node(node_id, 
+                   labels=[item_type.capitalize()], 
+                   type=item_type,
+                   path=path,
+                   caption=caption,
+                   name=os.path.basename(path))
+        
+        # Add Concept Nodes & Edges (Image -> Concept)
+        concepts = self._concepts_for(tags)
+        for concept_id in concepts:
+            if not G.has_node(concept_id):
+                G.add_node(concept_id, labels=["Concept"], type="concept", name=concept_id[4:])
+            
+            # Edge: Image -> Concept
+            G.add_edge(node_id, concept_id, type="has_concept", weight=1.0)
+
+        self._item_concepts[node_id] = concepts
+        return node_id
+
+    @staticmethod
+    def _add_cooccurrence(G, concepts):
+        # Form a clique over the concepts of one item
+        for i in range(len(concepts)):
+            for j in range(i + 1, len(concepts)):
+                u, v = concepts[i], concepts[j]
+                if G.has_edge(u, v):
+                    G[u][v]['weight'] += 1
+                else:
+                    G.add_edge(u, v, type="co_occurrence", weight=1)
+
+    @staticmethod
+    def _remove_cooccurrence(G, concepts):
+        for i in range(len(concepts)):
+            for j in range(i + 1, len(concepts)):
+                u, v = concepts[i], concepts[j]
+                if G.has_edge(u, v) and G[u][v].get('type') == "co_occurrence":
+                    G[u][v]['weight'] -= 1
+                    if G[u][v]['weight'] <= 0:
+                        G.remove_edge(u, v)
+
     def build_graph(self):
-        images = db.get_all_images()
+        with self._lock:
+            return self._build_graph()
+
+    def _build_graph(self):
+        images = self.db.get_all_images()
         current_count = len(images)
         
         # Return cached graph if valid and no new images
@@ -26,89 +104,269 @@ class GraphBuilder:
             return self._cached_graph
         
         self._last_image_count = current_count
-        ids, embeddings = db.get_all_embeddings()
+        with metrics.timer("graph_load"):
+            vectors = self.index.vectors()
         
         G = nx.Graph()
+        self._item_concepts = {}
         
-        # 1. Add Image Nodes
+        # 1. Add Image Nodes (2. and their Concept Nodes & Edges)
         # Map DB ID to Node ID (e.g., "img_1")
         img_id_map = {}
         
-        for img in images:
-            iid, path, caption, tags_json, item_type = img
-            node_id = f"img_{iid}"
-            img_id_map[iid] = node_id
-            
-            tags = json.loads(tags_json) if tags_json else []
-            
-            G.add_node(node_id, 
-                       labels=[item_type.capitalize()], 
-                       type=item_type,
-                       path=path,
-                       caption=caption,
-                       name=os.path.basename(path))
-            
-            # 2. Add Concept Nodes & Edges (Image -> Concept)
-            for tag in tags:
-                # Normalize tag
-                concept = tag.lower().strip()
-                if len(concept) < 2: continue
-                
-                concept_id = f"con_{concept}"
-                 
-                if not G.has_node(concept_id):
-                    G.add_node(concept_id, labels=["Concept"], type="concept", name=concept)
-                
-                # Edge: Image -> Concept
-                # Check if edge exists to increment weight? Usually binary here, but we can play.
-                G.add_edge(node_id, concept_id, type="has_concept", weight=1.0)
+        with metrics.timer("graph_nodes"):
+            for img in images:
+                img_id_map[img[0]] = self._add_item_node(G, img)
 
         # 3. Add Concept -> Concept Edges (Co-occurrence)
-        # Iterate over images, get all concepts, form clique
-        for img in images:
-            tags = json.loads(img[3]) if img[3] else []
-            concepts = [f"con_{t.lower().strip()}" for t in tags if len(t.lower().strip()) >= 2]
-            
-            for i in range(len(concepts)):
-                for j in range(i + 1, len(concepts)):
-                    u, v = concepts[i], concepts[j]
-                    if G.has_edge(u, v):
-                        G[u][v]['weight'] += 1
-                    else:
-                        G.add_edge(u, v, type="co_occurrence", weight=1)
+        with metrics.timer("graph_cooccurrence"):
+            for concepts in self._item_concepts.values():
+                self._add_cooccurrence(G, concepts)
 
         # 4. Add Image -> Image Edges (Similarity)
-        if len(embeddings) > 1:
-            sim_matrix = cosine_similarity(embeddings)
-            # embeddings order matches `ids` list
-            for i in range(len(ids)):
-                for j in range(i + 1, len(ids)):
-                    if sim_matrix[i][j] >= self.sim_threshold:
-                        img_node_a = img_id_map.get(ids[i])
-                        img_node_b = img_id_map.get(ids[j])
-                        if img_node_a and img_node_b:
-                            G.add_edge(img_node_a, img_node_b, 
-                                       type="similar", 
-                                       weight=float(sim_matrix[i][j]))
+        with metrics.timer("graph_similarity"):
+            for a, b, sim in self._similar_pairs(vectors):
+                img_node_a = img_id_map.get(a)
+                img_node_b = img_id_map.get(b)
+                if img_node_a and img_node_b:
+                    G.add_edge(img_node_a, img_node_b,
+                               type="similar",
+                               weight=sim)
 
         self._cached_graph = G
         self._cache_valid = True
+        self.version += 1
         return G
 
-    def export_cytoscape(self):
-        G = self.build_graph()
-        elements = []
-        
-        for node, data in G.nodes(data=True):
-            elements.append({
-                "data": {"id": node, **data}
-            })
+    def _margin(self, vectors):
+        # Coarse codes pick candidates a little below the threshold; re-ranking decides
+        return config.VECTOR_RERANK_MARGIN if self.index.coarse(vectors) else 0.0
+
+    def _similar_pairs(self, vectors):
+        """Yield (item ID, item ID, cosine) for every pair at or above sim_threshold."""
+        margin = self._margin(vectors)
+        for rows_a, rows_b, sims in vectors.pairs(self.sim_threshold - margin):
+            a, b = vectors.ids[rows_a], vectors.ids[rows_b]
+            if margin:
+                full = self.db.get_embeddings(np.unique(np.concatenate([a, b])).tolist())
+                keep = [k for k in range(len(a)) if a[k] in full and b[k] in full]
+                a, b = a[keep], b[keep]
+                if not len(a):
+                    continue
+                left = np.array([full[i] for i in a])
+                right = np.array([full[i] for i in b])
+                sims = np.einsum("ij,ij->i", normalize(left), normalize(right))
+            for k in np.flatnonzero(sims >= self.sim_threshold):
+                yield int(a[k]), int(b[k]), float(sims[k])
+
+    def _similar_to(self, iid, vec):
+        """(item ID, cosine) of other items at or above sim_threshold to vec."""
+        # As of the last patch: the item itself was just stored, which must not force a rebuild
+        vectors = self.index.vectors(refresh=False)
+        margin = self._margin(vectors)
+        scores = vectors.scores(vec)
+        keep = (scores >= self.sim_threshold - margin) & (vectors.ids != iid)
+        candidates, scores = vectors.ids[keep], scores[keep]
+        if margin:
+            candidates, scores = rerank(self.db.get_embeddings(candidates.tolist()), candidates, vec)
+        return [(int(i), float(s)) for i, s in zip(candidates, scores) if s >= self.sim_threshold]
+
+    def _remove_item(self, G, iid):
+        node_id = f"img_{iid}"
+        if not G.has_node(node_id):
+            return False
+        concepts = self._item_concepts.pop(node_id, [])
+        self._remove_cooccurrence(G, concepts)
+        G.remove_node(node_id)
+        # Drop concepts no longer attached to any item
+        for concept_id in set(concepts):
+            if G.has_node(concept_id) and not any(
+                G[concept_id][n].get('type') == "has_concept" for n in G[concept_id]
+            ):
+                G.remove_node(concept_id)
+        self._last_image_count -= 1
+        return True
+
+    def _snapshot(self, G, node_id, concepts):
+        """Copy the nodes and edges that adding/removing one item can change."""
+        nodes = {n: dict(G.nodes[n]) for n in [node_id, *concepts] if G.has_node(n)}
+        edges = {}
+        if G.has_node(node_id):
+            for nbr, data in G[node_id].items():
+                edges[self._edge_id(node_id, nbr)] = (node_id, nbr, dict(data))
+        present = sorted(c for c in nodes if c != node_id)
+        for i, u in enumerate(present):
+            for v in present[i:]:
+                if G.has_edge(u, v):
+                    edges[self._edge_id(u, v)] = (u, v, dict(G[u][v]))
+        return nodes, edges
+
+    def _diff(self, before, after, delta):
+        """Accumulate cytoscape upserts/removals between two snapshots into delta."""
+        nodes_before, edges_before = before
+        nodes_after, edges_after = after
+        for n, data in nodes_after.items():
+            if nodes_before.get(n) != data:
+                delta["upsert"][n] = {"data": {"id": n, **data}}
+                delta["remove"].discard(n)
+        for eid, (u, v, data) in edges_after.items():
+            if eid not in edges_before or edges_before[eid][2] != data:
+                delta["upsert"][eid] = self._edge_element(u, v, data)
+                delta["remove"].discard(eid)
+        for key in [*(n for n in nodes_before if n not in nodes_after),
+                    *(e for e in edges_before if e not in edges_after)]:
+            delta["upsert"].pop(key, None)
+            delta["remove"].add(key)
+
+    def _publish(self, delta):
+        if not delta["upsert"] and not delta["remove"]:
+            return
+        self.version += 1
+        upsert = list(delta["upsert"].values())
+        if self.layout.graph is self._cached_graph:
+            # Give new nodes a position next to their neighbours so preset layouts stay put
+            self.layout.extend(self._cached_graph, self.version)
+            for el in upsert:
+                if "source" not in el["data"]:
+                    self.layout.annotate(el["data"]["id"], el)
+        event_bus.publish("graph", {
+            "library": self.library,
+            "version": self.version,
+            "upsert": upsert,
+            "remove": sorted(delta["remove"]),
+        })
+
+    def update_items(self, image_ids):
+        """Patch newly added or re-analyzed items into the cached graph and publish the delta.
+
+        Falls back to a full rebuild on the next request if there is no valid cache.
+        """
+        with self._lock, metrics.timer("graph_update"):
+            if not (self._cache_valid and self._cached_graph is not None):
+                # Clients may hold a graph we can no longer diff against
+                event_bus.publish("resync", {"library": self.library})
+                return
+            G = self._cached_graph
+            delta = {"upsert": {}, "remove": set()}
+            for iid in image_ids:
+                img = self.db.get_image_by_id(iid)
+                if not img:
+                    continue
+                node_id = f"img_{iid}"
+                new_concepts = self._concepts_for(json.loads(img[3]) if img[3] else [])
+                affected = set(self._item_concepts.get(node_id, [])) | set(new_concepts)
+                before = self._snapshot(G, node_id, affected)
+
+                self._remove_item(G, iid)
+                self._add_item_node(G, img)
+                self._add_cooccurrence(G, self._item_concepts[node_id])
+                self._last_image_count += 1
+
+                vec = self.db.get_embedding(iid)
+                if vec is not None:
+                    for other, sim in self._similar_to(iid, vec):
+                        other_node = f"img_{other}"
+                        if G.has_node(other_node):
+                            G.add_edge(node_id, other_node, type="similar", weight=sim)
+                self.index.upsert(iid, vec)
+
+                self._diff(before, self._snapshot(G, node_id, affected), delta)
+            self._publish(delta)
+
+    def remove_items(self, image_ids):
+        """Remove deleted items from the cached graph without a full rebuild and publish the delta."""
+        with self._lock, metrics.timer("graph_update"):
+            if not (self._cache_valid and self._cached_graph is not None):
+                event_bus.publish("resync", {"library": self.library})
+                return
+            G = self._cached_graph
+            delta = {"upsert": {}, "remove": set()}
+            for iid in image_ids:
+                node_id = f"img_{iid}"
+                concepts = set(self._item_concepts.get(node_id, []))
+                before = self._snapshot(G, node_id, concepts)
+                if self._remove_item(G, iid):
+                    self._diff(before, self._snapshot(G, node_id, concepts), delta)
+                self.index.remove(iid)
+            self._publish(delta)
+
+    @staticmethod
+    def _edge_id(u, v):
+        # Stable regardless of the endpoint order networkx reports
+        a, b = sorted((u, v))
+        return f"e:{a}|{b}"
+
+    def _edge_element(self, u, v, data):
+        return {"data": {"id": self._edge_id(u, v), "source": u, "target": v, **data}}
+
+    def get_layout(self):
+        """Positions and communities for the current graph, cached until it changes."""
+        with self._lock:
+            G = self.build_graph()
+            vectors = self.index.vectors(refresh=False)
+            return self.layout.get(G, self.version, vectors.ids.tolist(), vectors.rows())
+
+    def export_cytoscape(self, with_layout=False, collapse=False, expand=()):
+        """Cytoscape elements for the graph.
+
+        with_layout adds precomputed positions and community ids; collapse replaces
+        every community of at least CLUSTER_MIN_SIZE nodes (except those in expand)
+        with a single summary node.
+        """
+        # Hold the lock so scan threads cannot patch the graph while it is serialized
+        with self._lock:
+            G = self.build_graph()
+            layout = self.get_layout() if (with_layout or collapse) else None
+            if collapse:
+                return self._export_collapsed(G, layout, set(expand))
+            elements = []
+            start = time.perf_counter()
             
+            for node, data in G.nodes(data=True):
+                element = {"data": {"id": node, **data}}
+                elements.append(layout.annotate(node, element) if layout else element)
+                
+            for u, v, data in G.edges(data=True):
+                elements.append(self._edge_element(u, v, data))
+                
+            metrics.observe("graph_export", time.perf_counter() - start)
+            return elements
+
+    def export_snapshot(self, with_layout=False, collapse=False, expand=()):
+        """(elements, version) read under one lock, so deltas after version apply on top."""
+        with self._lock:
+            return self.export_cytoscape(with_layout, collapse, expand), self.version
+
+    def _export_collapsed(self, G, layout, expand):
+        start = time.perf_counter()
+        members = defaultdict(list)
+        for node in G:
+            members[layout.communities.get(node)].append(node)
+
+        # Map every node to itself or to the summary node of its collapsed community
+        rep = {}
+        elements = []
+        for cid, nodes in members.items():
+            if cid is None or cid in expand or len(nodes) < config.CLUSTER_MIN_SIZE:
+                for node in nodes:
+                    rep[node] = node
+                    elements.append(layout.annotate(node, {"data": {"id": node, **G.nodes[node]}}))
+            else:
+                for node in nodes:
+                    rep[node] = f"cluster_{cid}"
+                elements.append(layout.cluster_element(G, cid, nodes))
+
+        links = {}
         for u, v, data in G.edges(data=True):
-            elements.append({
-                "data": {"source": u, "target": v, **data}
-            })
-            
+            a, b = rep[u], rep[v]
+            if a == u and b == v:
+                elements.append(self._edge_element(u, v, data))
+            elif a != b:
+                link = links.setdefault(self._edge_id(a, b), {"source": a, "target": b, "type": "cluster_link", "weight": 0})
+                link["weight"] += 1
+        elements.extend({"data": {"id": eid, **link}} for eid, link in links.items())
+
+        metrics.observe("graph_export", time.perf_counter() - start)
         return elements
 
 graph_builder = GraphBuilder()
@@ -0,0 +1,86 @@
+import os
+import threading
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from app.core import config
+
+# Analyzer owned by each pool process; the API process never loads the models in pool mode
+_process_analyzer = None
+
+
+def _init_process(num_threads):
+    global _process_analyzer
+    import torch
+    torch.set_num_threads(num_threads)
+    from app.core.analyzer import ImageAnalyzer
+    _process_analyzer = ImageAnalyzer()
+    if config.WARMUP:
+        _process_analyzer.warm_up()
+
+
+def _analyze_in_process(file_path, use_llm, api_key, model_id, provider, base_url):
+    result = _process_analyzer.analyze(file_path, use_llm, api_key, model_id, provider, base_url)
+    # Ship the embedding as raw float32 bytes instead of a pickled list of Python floats
+    if result and "embedding" in result:
+        result["embedding"] = np.asarray(result["embedding"], dtype=np.float32).tobytes()
+    return result
+
+
+class InferencePool:
+    """Runs ImageAnalyzer.analyze in separate processes so inference does not hold the API's GIL.
+
+    Each process decodes its own files and holds its own copy of the models; only
+    paths go in and small result dicts come back.
+    """
+
+    def __init__(self, workers=0, threads=0):
+        self.workers = workers
+        self.threads = threads or max(1, (os.cpu_count() or 1) // max(workers, 1))
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.workers > 0
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                print(f"Starting {self.workers} inference processes ({self.threads} threads each)...")
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=mp.get_context("spawn"),
+                    initializer=_init_process,
+                    initargs=(self.threads,)
+                )
+            return self._pool
+
+    def start(self):
+        """Spawn every process now (and warm them up if configured) instead of on the first file."""
+        pool = self._get_pool()
+        for _ in range(self.workers):
+            pool.submit(os.getpid)
+
+    def analyze(self, file_path, use_llm=False, api_key="", model_id="gemini-1.5-flash-latest", provider="gemini", base_url=""):
+        try:
+            result = self._get_pool().submit(
+                _analyze_in_process, file_path, use_llm, api_key, model_id, provider, base_url
+            ).result()
+        except BrokenProcessPool:
+            # A process died (e.g. out of memory); start a fresh pool for the next task
+            with self._lock:
+                self._pool = None
+            raise
+        if result and "embedding" in result:
+            result["embedding"] = np.frombuffer(result["embedding"], dtype=np.float32)
+        return result
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+inference_pool = InferencePool(config.INFERENCE_WORKERS, config.TORCH_THREADS)
@@ -0,0 +1,137 @@
+from collections import Counter
+import networkx as nx
+import numpy as np
+from app.core import config
+from app.core.metrics import metrics
+
+# Roughly one node width of room per node on each axis, in cytoscape pixels
+SPACING = 60
+
+
+def pca_2d(embeddings):
+    """Project embeddings onto their first two principal components."""
+    X = np.asarray(embeddings, dtype=np.float32)
+    X = X - X.mean(axis=0)
+    # Eigen-decompose the d x d covariance instead of an n x d SVD so memory stays flat
+    _, vecs = np.linalg.eigh(X.T @ X)
+    return X @ vecs[:, [-1, -2]]
+
+
+class GraphLayout:
+    """Node positions and communities for one cached graph.
+
+    A full layout seeds every item at its CLIP projection, refines it with a
+    force-directed pass and runs Louvain community detection. Items added by
+    incremental updates are placed next to their neighbours until enough of them
+    pile up to warrant recomputing everything.
+    """
+
+    def __init__(self):
+        self.graph = None
+        self.version = -1
+        self.positions = {}
+        self.communities = {}
+        self._full_size = 0
+        self._placed = 0
+
+    def get(self, G, version, ids, embeddings):
+        if G is not self.graph:
+            self.compute(G, version, ids, embeddings)
+            return self
+        if version != self.version:
+            self.extend(G, version)
+        # Published deltas extend the layout too (and bring it up to version), so check
+        # how much was placed incrementally on every request, not only on new versions
+        if self._placed > config.LAYOUT_REFRESH * max(self._full_size, 1):
+            self.compute(G, version, ids, embeddings)
+        return self
+
+    def compute(self, G, version, ids, embeddings):
+        with metrics.timer("graph_layout"):
+            pos = self._seed_positions(G, ids, embeddings)
+            if 0 < len(G) <= config.LAYOUT_MAX_NODES and config.LAYOUT_ITERATIONS > 0:
+                pos = nx.spring_layout(G, pos=pos, iterations=config.LAYOUT_ITERATIONS,
+                                       weight="weight", seed=0)
+            scale = SPACING * np.sqrt(max(len(G), 1))
+            self.positions = {n: (float(x) * scale, float(y) * scale) for n, (x, y) in pos.items()}
+
+        with metrics.timer("graph_communities"):
+            groups = nx.community.louvain_communities(G, weight="weight", seed=0) if len(G) else []
+            # Largest community first so ids are stable-ish between runs
+            groups = sorted(groups, key=len, reverse=True)
+            self.communities = {n: cid for cid, members in enumerate(groups) for n in members}
+
+        self.graph = G
+        self.version = version
+        self._full_size = len(G)
+        self._placed = 0
+
+    def _seed_positions(self, G, ids, embeddings):
+        rng = np.random.default_rng(0)
+        seed = {}
+        if len(ids) > 1:
+            xy = pca_2d(embeddings)
+            xy /= np.abs(xy).max() or 1.0
+            for iid, p in zip(ids, xy):
+                if f"img_{iid}" in G:
+                    seed[f"img_{iid}"] = p
+        # Concepts (and items without embeddings) start at the centre of their neighbours
+        for n in G:
+            if n not in seed:
+                nbrs = [seed[m] for m in G[n] if m in seed]
+                seed[n] = np.mean(nbrs, axis=0) + rng.normal(0, 0.01, 2) if nbrs else rng.uniform(-1, 1, 2)
+        return seed
+
+    def extend(self, G, version):
+        """Drop removed nodes and place new ones next to their already placed neighbours."""
+        for n in [n for n in self.positions if n not in G]:
+            del self.positions[n]
+            self.communities.pop(n, None)
+
+        rng = np.random.default_rng(version)
+        next_cid = max(self.communities.values(), default=-1) + 1
+        for n in G:
+            if n in self.positions:
+                continue
+            placed = [m for m in G[n] if m in self.positions]
+            if placed:
+                x, y = np.mean([self.positions[m] for m in placed], axis=0) + rng.normal(0, SPACING / 2, 2)
+                votes = Counter(self.communities[m] for m in placed if m in self.communities)
+            else:
+                x, y = rng.uniform(-1, 1, 2) * SPACING * np.sqrt(max(len(G), 1))
+                votes = None
+            self.positions[n] = (float(x), float(y))
+            if votes:
+                self.communities[n] = votes.most_common(1)[0][0]
+            else:
+                self.communities[n] = next_cid
+                next_cid += 1
+            self._placed += 1
+        self.version = version
+
+    def annotate(self, node_id, element):
+        """Add the position and community of node_id to its cytoscape element."""
+        if node_id in self.positions:
+            x, y = self.positions[node_id]
+            element["position"] = {"x": x, "y": y}
+            element["data"]["community"] = self.communities.get(node_id)
+        return element
+
+    def cluster_element(self, G, cid, members):
+        """Summary node standing in for a collapsed community."""
+        concepts = sorted((n for n in members if G.nodes[n].get("type") == "concept"),
+                          key=G.degree, reverse=True)
+        name = ", ".join(G.nodes[c]["name"] for c in concepts[:3]) or G.nodes[members[0]].get("name", "")
+        x, y = np.mean([self.positions[n] for n in members], axis=0)
+        return {
+            "data": {
+                "id": f"cluster_{cid}",
+                "labels": ["Cluster"],
+                "type": "cluster",
+                "community": cid,
+                "name": name,
+                "size": len(members),
+                "items": len(members) - len(concepts),
+            },
+            "position": {"x": float(x), "y": float(y)},
+        }
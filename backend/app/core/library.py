@@ -0,0 +1,82 @@
+import os
+import re
+import threading
+from app.core import config
+from app.core.graph import GraphBuilder, graph_builder
+from app.db.storage import Storage, db
+
+DEFAULT_LIBRARY = "default"
+LIBRARY_NAME = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class Library:
+    """One named library: its own database shard, cached graph and vector index."""
+
+    def __init__(self, name, storage, graph):
+        self.name = name
+        self.db = storage
+        self.graph = graph
+        # Shared with the graph so the library's vectors are held in memory once
+        self.index = graph.index
+
+
+class LibraryManager:
+    """Named libraries, each with its own SQLite file and graph.
+
+    "default" is the original database (which also holds the scan job queue); other
+    libraries live in LIBRARY_DIR/<name>.sqlite and are opened on first use, so only
+    the libraries being scanned or viewed keep a graph in memory.
+    """
+
+    def __init__(self, root=None):
+        self.root = root or config.LIBRARY_DIR
+        self._libraries = {DEFAULT_LIBRARY: Library(DEFAULT_LIBRARY, db, graph_builder)}
+        self._lock = threading.Lock()
+
+    def _path(self, name):
+        return os.path.join(self.root, f"{name}.sqlite")
+
+    def get(self, name=DEFAULT_LIBRARY, create=False):
+        """Return the named library.
+
+        Raises ValueError for invalid names and KeyError if the library does not
+        exist and create is False.
+        """
+        name = name or DEFAULT_LIBRARY
+        with self._lock:
+            library = self._libraries.get(name)
+            if library:
+                return library
+            if not LIBRARY_NAME.match(name):
+                raise ValueError(f"Invalid library name: {name!r}")
+            if not create and not os.path.exists(self._path(name)):
+                raise KeyError(name)
+            os.makedirs(self.root, exist_ok=True)
+            storage = Storage(self._path(name))
+            library = Library(name, storage, GraphBuilder(storage=storage, library=name))
+            self._libraries[name] = library
+            return library
+
+    def names(self):
+        names = {DEFAULT_LIBRARY, *self._libraries}
+        if os.path.isdir(self.root):
+            stems = (f[:-len(".sqlite")] for f in os.listdir(self.root) if f.endswith(".sqlite"))
+            # Skip stray files whose names get() would reject
+            names.update(stem for stem in stems if LIBRARY_NAME.match(stem))
+        return sorted(names)
+
+    def similar(self, vector, k=10, names=None, exclude=None):
+        """Nearest items to vector across libraries, best first.
+
+        exclude=(library, item ID) leaves the query item itself out of the results.
+        """
+        results = []
+        for name in names or self.names():
+            library = self.get(name)
+            skip = exclude[1] if exclude and exclude[0] == name else None
+            for iid, score in library.index.search(vector, k, skip):
+                results.append({"library": name, "id": iid, "score": score})
+        results.sort(key=lambda r: r["score"], reverse=True)
+        return results[:k]
+
+libraries = LibraryManager()
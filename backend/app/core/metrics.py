@@ -0,0 +1,80 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds in seconds, from thumbnail-fast to LLM-slow
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Metrics:
+    """Per-stage timing histograms and event counters, exposed in Prometheus text format.
+
+    Stages are things like "blip", "ocr", "db_write" or "graph_similarity"; counters are
+    events like "thumbnail_cache_hit". Everything lives in this process only.
+    """
+
+    def __init__(self, prefix="imagegraph"):
+        self.prefix = prefix
+        self._stages = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            hist = self._stages.get(stage)
+            if hist is None:
+                hist = self._stages[stage] = {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    hist["buckets"][i] += 1
+            hist["sum"] += seconds
+            hist["count"] += 1
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def inc(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def summary(self):
+        """Compact per-stage view for /progress."""
+        with self._lock:
+            stages = {
+                stage: {
+                    "count": h["count"],
+                    "total_s": round(h["sum"], 3),
+                    "mean_ms": round(1000 * h["sum"] / h["count"], 1) if h["count"] else 0.0,
+                }
+                for stage, h in self._stages.items()
+            }
+            return {"stages": stages, "counters": dict(self._counters)}
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        name = f"{self.prefix}_stage_seconds"
+        lines = [
+            f"# HELP {name} Time spent in each processing stage.",
+            f"# TYPE {name} histogram",
+        ]
+        with self._lock:
+            for stage, h in sorted(self._stages.items()):
+                for bound, count in zip(BUCKETS, h["buckets"]):
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {h["count"]}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {h["sum"]}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {h["count"]}')
+
+            name = f"{self.prefix}_events_total"
+            lines.append(f"# HELP {name} Count of notable events (cache hits, skipped OCR, failures).")
+            lines.append(f"# TYPE {name} counter")
+            for event, value in sorted(self._counters.items()):
+                lines.append(f'{name}{{event="{event}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
@@ -0,0 +1,254 @@
+import threading
+import numpy as np
+from app.core import config
+
+# Storage formats for embeddings. float16 and int8 vectors are normalized before
+# encoding; float32 keeps the raw model output as older databases did.
+FORMATS = ("float32", "float16", "int8")
+# Rows compared at a time, so no n x n similarity matrix is ever held in memory
+BLOCK = 2048
+# Rows used to fit the PCA projection
+PCA_SAMPLE = 20000
+# Search over-fetches this many times k candidates when they will be re-ranked
+RERANK_FACTOR = 4
+_PRECISION = {"int8": 0, "float16": 1, "float32": 2}
+
+
+def normalize(vectors):
+    """L2-normalize rows so a dot product is the cosine similarity."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+
+def quantize(vectors, fmt):
+    """Encode normalized float32 rows as (codes, per-row scales)."""
+    if fmt == "int8":
+        scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+        codes = np.round(vectors / scales[:, None]).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    dtype = np.float16 if fmt == "float16" else np.float32
+    return vectors.astype(dtype), np.ones(len(vectors), dtype=np.float32)
+
+
+def encode(vector, fmt):
+    """Encode one embedding for storage. Returns (blob, scale); scale is None except for int8."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown vector format: {fmt!r}")
+    if fmt == "float32":
+        return np.asarray(vector, dtype=np.float32).tobytes(), None
+    codes, scales = quantize(normalize(np.asarray(vector).reshape(1, -1)), fmt)
+    return codes[0].tobytes(), float(scales[0]) if fmt == "int8" else None
+
+
+def decode(blob, fmt, scale):
+    """Decode a stored embedding to float32. Rows written before formats existed have fmt None."""
+    if fmt == "int8":
+        return np.frombuffer(blob, dtype=np.int8).astype(np.float32) * np.float32(scale)
+    if fmt == "float16":
+        return np.frombuffer(blob, dtype=np.float16).astype(np.float32)
+    return np.frombuffer(blob, dtype=np.float32)
+
+
+def rerank(full, ids, query):
+    """Exact float32 cosine of query to the full vectors ({id: vector}) of ids.
+
+    IDs missing from full (deleted meanwhile) are dropped. Returns (ids, scores).
+    """
+    ids = np.array([i for i in ids if i in full], dtype=np.int64)
+    if not len(ids):
+        return ids, np.empty(0, dtype=np.float32)
+    return ids, normalize(np.array([full[i] for i in ids])) @ normalize(query)
+
+
+class CompactVectors:
+    """Item embeddings held in memory in a compact format for similarity search.
+
+    Vectors are normalized, optionally projected onto `dim` principal components,
+    and stored as float32, float16 or int8 codes. Similarities are computed block by
+    block straight from the codes. When the codes are coarser than the stored vectors,
+    callers re-rank candidates against the full stored vectors in float32.
+    """
+
+    def __init__(self, fmt="float32", components=None):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown vector format: {fmt!r}")
+        self.fmt = fmt
+        self.components = components
+        self.ids = np.empty(0, dtype=np.int64)
+        self.codes = None
+        self.scales = np.empty(0, dtype=np.float32)
+
+    @classmethod
+    def build(cls, batches, fmt="float32", dim=0):
+        """Build from an iterable of (ids, float32 matrix) batches, fitting PCA on the first rows."""
+        batches = iter(batches)
+        head_ids, head = [], []
+        rows = 0
+        for ids, vectors in batches:
+            head_ids.extend(ids)
+            head.append(normalize(vectors))
+            rows += len(ids)
+            if rows >= PCA_SAMPLE:
+                break
+        head = np.vstack(head) if head else np.empty((0, 0), dtype=np.float32)
+
+        components = None
+        if dim and len(head) > dim and dim < head.shape[1]:
+            # Uncentered, so projected dot products approximate the original cosines
+            _, eigvecs = np.linalg.eigh(head.T @ head)
+            components = np.ascontiguousarray(eigvecs[:, ::-1][:, :dim], dtype=np.float32)
+
+        compact = cls(fmt, components)
+        compact.add(head_ids, head)
+        for ids, vectors in batches:
+            compact.add(ids, vectors)
+        return compact
+
+    def coarser_than(self, stored_fmt):
+        """True if these codes lose precision relative to vectors stored as stored_fmt,
+        i.e. re-ranking against the stored vectors can change the scores."""
+        return self.components is not None or _PRECISION[self.fmt] < _PRECISION.get(stored_fmt, 2)
+
+    @property
+    def nbytes(self):
+        return 0 if self.codes is None else self.codes.nbytes + self.scales.nbytes
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _encode(self, vectors):
+        vectors = normalize(vectors)
+        if self.components is not None:
+            vectors = normalize(vectors @ self.components)
+        return quantize(vectors, self.fmt)
+
+    def add(self, ids, vectors):
+        if len(ids) == 0:
+            return
+        codes, scales = self._encode(np.asarray(vectors).reshape(len(ids), -1))
+        self.ids = np.concatenate([self.ids, np.asarray(ids, dtype=np.int64)])
+        self.codes = codes if self.codes is None else np.concatenate([self.codes, codes])
+        self.scales = np.concatenate([self.scales, scales])
+
+    def remove(self, iid):
+        idx = np.flatnonzero(self.ids == iid)
+        if len(idx):
+            self.ids = np.delete(self.ids, idx)
+            self.codes = np.delete(self.codes, idx, axis=0)
+            self.scales = np.delete(self.scales, idx)
+
+    def rows(self, start=0, stop=None):
+        """Decode a range of rows to float32."""
+        if self.codes is None:
+            return np.empty((0, 0), dtype=np.float32)
+        block = self.codes[start:stop].astype(np.float32)
+        if self.fmt == "int8":
+            block *= self.scales[start:stop, None]
+        return block
+
+    def scores(self, vector):
+        """Approximate cosine similarity of vector to every row."""
+        if not len(self):
+            return np.empty(0, dtype=np.float32)
+        query = self.rows_for(vector)
+        return np.concatenate([self.rows(i, i + BLOCK) @ query for i in range(0, len(self), BLOCK)])
+
+    def rows_for(self, vector):
+        """Encode and decode a query exactly as stored rows are, so scores are comparable."""
+        codes, scales = self._encode(np.asarray(vector).reshape(1, -1))
+        query = codes[0].astype(np.float32)
+        return query * scales[0] if self.fmt == "int8" else query
+
+    def pairs(self, threshold):
+        """Yield (rows_a, rows_b, scores) arrays for every pair i < j scoring at least threshold."""
+        n = len(self)
+        for i in range(0, n, BLOCK):
+            a = self.rows(i, i + BLOCK)
+            for j in range(i, n, BLOCK):
+                sims = a @ self.rows(j, j + BLOCK).T
+                if i == j:
+                    # Diagonal block: keep the upper triangle only
+                    sims[np.tril_indices(len(a), 0, sims.shape[1])] = -np.inf
+                r, c = np.nonzero(sims >= threshold)
+                if len(r):
+                    yield r + i, c + j, sims[r, c]
+
+
+class VectorIndex:
+    """The compact vectors of one library, shared by its graph and similarity search.
+
+    Built from storage on first use. The graph patches in the items it updates or
+    removes, which only advances the index if it was exactly one write behind that
+    item's write; any other change to the storage triggers a rebuild. The vectors of
+    a library are only held in memory once.
+    """
+
+    def __init__(self, storage):
+        self.db = storage
+        self._revision = None
+        self._vectors = CompactVectors(config.VECTOR_INDEX_FORMAT)
+        self._lock = threading.RLock()
+
+    def vectors(self, refresh=True):
+        """The current CompactVectors, rebuilt if storage changed behind our back.
+
+        refresh=False skips that check for callers about to patch in the change.
+        """
+        with self._lock:
+            if self._revision is None or (refresh and self._revision != self.db.revision):
+                revision = self.db.revision
+                self._vectors = CompactVectors.build(
+                    self.db.iter_embeddings(), config.VECTOR_INDEX_FORMAT, config.VECTOR_DIM
+                )
+                self._revision = revision
+            return self._vectors
+
+    def coarse(self, vectors):
+        """True if vectors lose precision against storage, so results need re-ranking."""
+        return vectors.coarser_than(self.db.vector_format)
+
+    def _advance(self, iid):
+        # Caller holds _lock. True if the write of iid is the only one the index lacks.
+        if self._revision is None:
+            return False  # Not built yet; the first use loads it from storage
+        written = self.db.write_revision(iid)
+        if written is None or self._revision != written - 1:
+            # Already rebuilt past this write, or other writes are missing: reload on next use
+            self._revision = None
+            return False
+        self._revision = written
+        return True
+
+    def upsert(self, iid, vector):
+        """Patch in an item just written to storage."""
+        with self._lock:
+            if self._advance(iid):
+                self._vectors.remove(iid)
+                if vector is not None:
+                    self._vectors.add([iid], np.asarray(vector).reshape(1, -1))
+
+    def remove(self, iid):
+        """Drop an item just deleted from storage."""
+        with self._lock:
+            if self._advance(iid):
+                self._vectors.remove(iid)
+
+    def search(self, vector, k=10, exclude=None):
+        """Return up to k (item ID, cosine similarity) pairs, best first."""
+        with self._lock:
+            vectors = self.vectors()
+            if len(vectors) == 0 or k <= 0:
+                return []
+            ids = vectors.ids
+            scores = vectors.scores(vector)
+        if exclude is not None:
+            scores[ids == exclude] = -np.inf
+        coarse = self.coarse(vectors)
+        n = min(k * RERANK_FACTOR if coarse else k, len(ids))
+        top = np.argpartition(-scores, n - 1)[:n]
+        top = top[np.isfinite(scores[top])]
+        ids, scores = ids[top], scores[top]
+        if coarse:
+            ids, scores = rerank(self.db.get_embeddings(ids.tolist()), ids, vector)
+        order = np.argsort(-scores)[:k]
+        return [(int(ids[i]), float(scores[i])) for i in order]
@@ -0,0 +1,214 @@
+import os
+import threading
+import time
+from app.core.worker import worker, VALID_EXTS
+from app.core.library import libraries, DEFAULT_LIBRARY
+
+# watchdog is optional: without it every root is watched by polling stored mtimes
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+
+class _EventHandler(FileSystemEventHandler):
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.watcher.notify(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.watcher.notify(event.src_path)
+
+    def on_deleted(self, event):
+        if event.is_directory:
+            self.watcher.reconcile_all()
+        else:
+            self.watcher.notify(event.src_path)
+
+    def on_moved(self, event):
+        if event.is_directory:
+            # A moved/deleted folder only reports one event, so reconcile the whole root
+            self.watcher.reconcile_all()
+        else:
+            self.watcher.notify(event.src_path)
+            self.watcher.notify(event.dest_path)
+
+
+class FolderWatcher:
+    """Keeps watched folders in sync with the database.
+
+    Filesystem events (or mtime polling) mark paths as dirty; once a path has been
+    quiet for `debounce` seconds it is re-analyzed or removed, and the cached graph
+    is patched in place.
+    """
+
+    def __init__(self, debounce=2.0, poll_interval=10.0):
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.roots = {}
+        self._pending = {}
+        # path -> mtime of files that failed analysis, so polling does not retry them forever
+        self._failed = {}
+        self._cond = threading.Condition()
+        self._dispatcher = None
+
+    def watch(self, folder_path, use_llm=False, api_key="", model_id="gemini-1.5-flash-latest", provider="gemini", base_url="", poll=False, library=DEFAULT_LIBRARY):
+        root = os.path.abspath(folder_path)
+        if root in self.roots:
+            return False
+
+        entry = {
+            "options": (use_llm, api_key, model_id, provider, base_url, library),
+            "library": library,
+            "mode": "poll" if (poll or Observer is None) else "events",
+            "stop": threading.Event(),
+            "observer": None,
+            "thread": None,
+        }
+
+        if entry["mode"] == "events":
+            observer = Observer()
+            observer.schedule(_EventHandler(self), root, recursive=True)
+            observer.daemon = True
+            observer.start()
+            entry["observer"] = observer
+
+        # Registered before polling starts so the first reconcile can find its library
+        self.roots[root] = entry
+        if entry["mode"] == "poll":
+            entry["thread"] = threading.Thread(target=self._poll_loop, args=(root, entry["stop"]), daemon=True)
+            entry["thread"].start()
+        self._ensure_dispatcher()
+        worker.log(f"Watching {root} into library '{library}' ({entry['mode']})")
+
+        # Pick up anything that changed while the folder was not being watched
+        if entry["mode"] == "events":
+            threading.Thread(target=self.reconcile, args=(root,), daemon=True).start()
+        return True
+
+    def unwatch(self, folder_path):
+        root = os.path.abspath(folder_path)
+        entry = self.roots.pop(root, None)
+        if not entry:
+            return False
+        entry["stop"].set()
+        if entry["observer"]:
+            entry["observer"].stop()
+        worker.log(f"Stopped watching {root}")
+        return True
+
+    def list_watches(self):
+        return [{"path": root, "mode": entry["mode"], "library": entry["library"]}
+                for root, entry in list(self.roots.items())]
+
+    def notify(self, path):
+        if not path.lower().endswith(VALID_EXTS):
+            return
+        with self._cond:
+            self._pending[os.path.abspath(path)] = time.monotonic()
+            self._cond.notify()
+
+    def reconcile(self, root):
+        """Compare the folder on disk with stored mtimes and mark differences dirty."""
+        entry = self.roots.get(root)
+        if entry is None:
+            return
+        stored = libraries.get(entry["library"], create=True).db.get_mtimes(root)
+        seen = set()
+        for dirpath, _, filenames in os.walk(root):
+            for f in filenames:
+                if not f.lower().endswith(VALID_EXTS):
+                    continue
+                path = os.path.join(dirpath, f)
+                seen.add(path)
+                try:
+                    mtime = os.path.getmtime(path)
+                except OSError:
+                    continue
+                if stored.get(path) != mtime and self._failed.get(path) != mtime:
+                    self.notify(path)
+        for path in stored:
+            if path not in seen:
+                self.notify(path)
+
+    def reconcile_all(self):
+        for root in list(self.roots):
+            self.reconcile(root)
+
+    def _poll_loop(self, root, stop):
+        while not stop.is_set():
+            try:
+                self.reconcile(root)
+            except Exception as e:
+                worker.log(f"Watch poll failed for {root}: {e}")
+            stop.wait(self.poll_interval)
+
+    def _ensure_dispatcher(self):
+        if self._dispatcher is None or not self._dispatcher.is_alive():
+            self._dispatcher = threading.Thread(target=self._dispatch_loop, daemon=True)
+            self._dispatcher.start()
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                # Sleep without a timeout while idle; wake only for the next quiet path
+                while not self._pending:
+                    self._cond.wait()
+                now = time.monotonic()
+                due = [p for p, t in self._pending.items() if now - t >= self.debounce]
+                if not due:
+                    next_due = min(self._pending.values()) + self.debounce
+                    self._cond.wait(max(next_due - now, 0.05))
+                    continue
+                for p in due:
+                    del self._pending[p]
+            try:
+                self._apply(due)
+            except Exception as e:
+                # Keep dispatching: one bad batch must not stop every watched root from syncing
+                worker.log(f"Watch update failed for {len(due)} paths: {e}")
+
+    def _entry_for(self, path):
+        # Snapshot: unwatch() may pop roots from the request thread meanwhile
+        for root, entry in list(self.roots.items()):
+            if path.startswith(os.path.join(root, "")):
+                return entry
+        return None
+
+    def _apply(self, paths):
+        # process_file patches the graph itself; only deletions are batched here (per library)
+        removed = {}
+        for path in paths:
+            entry = self._entry_for(path)
+            if entry is None:
+                continue  # Root was unwatched while the event was pending
+            options = entry["options"]
+            library = libraries.get(entry["library"], create=True)
+            if os.path.isfile(path):
+                try:
+                    mtime = os.path.getmtime(path)
+                except OSError:
+                    continue  # Deleted again; its delete event is already pending
+                if library.db.get_mtime(path) == mtime:
+                    continue  # Touched but unchanged since it was last analyzed
+                img_id = worker.process_file(path, *options)
+                if img_id is not None:
+                    self._failed.pop(path, None)
+                else:
+                    self._failed[path] = mtime
+            else:
+                self._failed.pop(path, None)
+                img_id = library.db.delete_image_by_path(path)
+                if img_id is not None:
+                    removed.setdefault(library, []).append(img_id)
+                    worker.log(f"Removed {os.path.basename(path)} from graph.")
+        for library, ids in removed.items():
+            library.graph.remove_items(ids)
+
+watcher = FolderWatcher()
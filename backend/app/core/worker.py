@@ -1,155 +1,358 @@
 import os
+import cProfile
+import pstats
 import threading
 import time
 from app.core.analyzer import analyzer
+from app.core.metrics import metrics
+from app.core import config
+from app.core.inference import inference_pool
+from app.core.events import event_bus
+from app.core.library import libraries, DEFAULT_LIBRARY
 from app.db.storage import db
-import queue
+
+VALID_EXTS = ('.jpg', '.jpeg', '.png', '.webp', '.txt')
 
 class ScanWorker:
+    """Processes scan jobs persisted in the database.
+
+    Each /scan enqueues a job (one task per file); the worker thread claims tasks in
+    priority order until none are left, so jobs survive stops, crashes and restarts.
+    """
+
     def __init__(self):
-        self.queue = queue.Queue()
         self.status = "idle"
         self.total_files = 0
         self.processed_files = 0
         self.current_file = ""
+        self.current_job = None
         self.logs = []
         self._stop_event = threading.Event()
-        self.thread = None
+        # Serializes in-process model use between scan threads and the folder watcher
+        self._analyze_lock = threading.Lock()
+        # Guards status changes so a job enqueued while the thread exits is not stranded
+        self._state_lock = threading.Lock()
+        self._active_threads = 0
+        self.threads = []
+        # job_id -> pstats.Stats accumulated from the profiled tasks of a job
+        self._profiles = {}
+        # Held by the one scan thread currently running a task under cProfile
+        self._profile_lock = threading.Lock()
+        # job_id -> LLM API key, kept in memory only so it is never written to the database
+        self._api_keys = {}
 
     def log(self, message):
         timestamp = time.strftime("%H:%M:%S")
-        self.logs.append(f"[{timestamp}] {message}")
+        line = f"[{timestamp}] {message}"
+        self.logs.append(line)
         if len(self.logs) > 50:
             self.logs.pop(0)
+        event_bus.publish("log", {"line": line})
 
-    def start_scan(self, folder_path, use_llm=False, api_key="", model_id="gemini-1.5-flash-latest", provider="gemini", base_url=""):
-        if self.status == "scanning":
-            return False
+    def publish_progress(self):
+        event_bus.publish("progress", self.get_progress(include_logs=False))
+
+    def start_scan(self, folder_path, use_llm=False, api_key="", model_id="gemini-1.5-flash-latest", provider="gemini", base_url="", priority=0, profile=False, library=DEFAULT_LIBRARY):
+        """Enqueue a scan job for the folder and make sure the worker is running. Returns the job ID.
+
+        Scanned items are stored in the named library; the job itself is always kept
+        in the default database. The API key is not persisted: after a restart it has
+        to be passed to resume() again.
+
+        With profile=True the job's tasks run under cProfile, one at a time since only
+        one profiler can be active per process, and the combined stats are written to
+        PROFILE_DIR/scan_<job_id>.prof when the job finishes.
+        """
+        folder_path = os.path.abspath(folder_path)
         
+        # Enqueue files
+        files = []
+        with metrics.timer("discovery"):
+            for root, _, filenames in os.walk(folder_path):
+                for f in filenames:
+                    if f.lower().endswith(VALID_EXTS):
+                        files.append(os.path.join(root, f))
+
+        options = {
+            "use_llm": use_llm,
+            "model_id": model_id,
+            "provider": provider,
+            "base_url": base_url,
+            "profile": profile,
+            "library": library,
+        }
+        job_id = db.create_job(folder_path, files, options, priority)
+        if api_key:
+            self._api_keys[job_id] = api_key
+        self.ensure_running(added=len(files))
+        
+        self.log(f"Queued scan #{job_id} of {folder_path} into library '{library}' ({len(files)} files, priority {priority}).")
+        if use_llm:
+            self.log(f"Using {provider.upper()} Model: {model_id}")
+        return job_id
+
+    def recover(self):
+        """Re-queue tasks interrupted by a crash or restart and run the pending jobs.
+
+        Paused jobs stay paused until resume(). Tasks are only re-queued while no scan
+        thread is alive; otherwise in_progress tasks are still being analyzed.
+        """
+        with self._state_lock:
+            interrupted = 0 if self.status == "scanning" else db.requeue_interrupted_tasks()
+        # Jobs whose last file finished right before a stop or crash have nothing left to run
+        for job in db.get_jobs():
+            if job["status"] in ('pending', 'in_progress'):
+                db.finish_job_if_complete(job["id"])
+        running = self.ensure_running()
+        if interrupted:
+            self.log(f"Re-queued {interrupted} interrupted tasks.")
+        return running
+
+    def resume(self, api_key=""):
+        """Resume paused jobs, recovering interrupted tasks too.
+
+        api_key is used for resumed jobs whose key was lost with a restart.
+        """
+        db.set_jobs_status(('paused',), 'pending')
+        for job in db.get_jobs():
+            if job["status"] in ('pending', 'in_progress'):
+                self.set_api_key(job["id"], api_key)
+        return self.recover()
+
+    def set_api_key(self, job_id, api_key):
+        """Provide the LLM API key for a job unless it still has one."""
+        if api_key:
+            self._api_keys.setdefault(job_id, api_key)
+
+    def ensure_running(self, added=0):
+        """Start the worker thread if there is queued work. Returns True if work is running."""
+        with self._state_lock:
+            if self.status == "scanning":
+                # The running thread will pick the new tasks up
+                self.total_files += added
+                self._stop_event.clear()
+                self.publish_progress()
+                return True
+            if db.count_pending_tasks() > 0:
+                self._start()
+                return True
+        return False
+
+    def _start(self):
+        # Caller holds _state_lock
         self.status = "scanning"
-        self.total_files = 0
+        self.total_files = db.count_pending_tasks()
         self.processed_files = 0
         self.logs = []
         self._stop_event.clear()
-        self.use_llm = use_llm
-        self.api_key = api_key
-        self.model_id = model_id
-        self.provider = provider
-        self.base_url = base_url
-        
-        self.log(f"Starting scan of {folder_path}...")
-        if use_llm:
-            self.log(f"Using {provider.upper()} Model: {model_id}")
-        
-        # Enqueue files
-        valid_exts = ('.jpg', '.jpeg', '.png', '.webp', '.txt')
-        files = []
-        for root, _, filenames in os.walk(folder_path):
-            for f in filenames:
-                if f.lower().endswith(valid_exts):
-                    files.append(os.path.join(root, f))
-        
-        self.total_files = len(files)
-        self.log(f"Found {self.total_files} files.")
-        
-        for f in files:
-            self.queue.put(f)
-            
-        self.thread = threading.Thread(target=self._process_queue)
-        self.thread.start()
-        return True
+        # One thread per inference process keeps every process busy
+        self._active_threads = max(inference_pool.workers, 1)
+        # Named so they are easy to pick out in py-spy dumps
+        self.threads = [
+            threading.Thread(target=self._process_queue, name=f"scan-worker-{i}", daemon=True)
+            for i in range(self._active_threads)
+        ]
+        for t in self.threads:
+            t.start()
+        self.publish_progress()
 
     def _process_queue(self):
-        while not self.queue.empty() and not self._stop_event.is_set():
-            file_path = self.queue.get()
+        while True:
+            with self._state_lock:
+                task = db.claim_next_task()
+                if task is None:
+                    self._active_threads -= 1
+                    if self._active_threads == 0:
+                        self._finish()
+                    return
+            task_id, job_id, file_path, options = task
+            self.current_job = job_id
             self.current_file = file_path
-            
-            ext = os.path.splitext(file_path)[1].lower()
-            item_type = "text" if ext == ".txt" else "image"
-            fname = os.path.basename(file_path)
+            self.publish_progress()
+            profiler = self._start_profiler() if options.pop("profile", False) else None
+            options["api_key"] = self._api_keys.get(job_id, "")
 
             try:
-                # Analyze
-                result = analyzer.analyze(file_path, self.use_llm, self.api_key, self.model_id, self.provider, self.base_url)
-                if result:
-                    # Check if it's an error from LLM
-                    if "error" in result:
-                        err_reason = result["error"]
-                        self.log(f"{self.provider.upper()} Failed for {fname}: {err_reason}. Falling back to local...")
-                        # Run local fallback manually here to get actual content
-                        result = analyzer.analyze(file_path, use_llm=False)
-                        if not result:
-                            self.log(f"Fallback also failed for {fname}")
-                            continue
-
-                    metadata = result.get("metadata", {})
-                    method = metadata.get("method", "Unknown")
-                    duration = metadata.get("duration", 0)
-                    
-                    self.log(f"{method}: Analyzed {fname} in {duration:.1f}s")
-                    
-                    # If LLM/Analysis gave us tags, use them.
-                    if 'tags' in result and result['tags']:
-                        tags = result['tags']
-                    else:
-                        caption_graph = result.get('caption', "").lower().split()
-                        ocr_graph = result.get('ocr_text', "").lower().split()
-                        
-                        # Basic stop word removal (very basic)
-                        stop_words = {'the', 'and', 'this', 'that', 'with', 'from', 'image', 'picture', 'photo'}
-                        tags = list(set([w.strip(".,") for w in caption_graph + ocr_graph if len(w) > 3 and w not in stop_words]))
-                    
-                    db.add_image(
-                        path=file_path,
-                        type=item_type,
-                        thumbnail_path="", 
-                        caption=result.get('caption', ""),
-                        ocr_text=result.get('ocr_text', "") if item_type == "image" else result.get('content', ""),
-                        embedding=result['embedding'],
-                        tags=tags
-                    )
-                    self.log(f"Saved {fname} to graph.")
+                img_id = self._analyze_and_store(file_path, **options)
+                error = None if img_id is not None else "Analysis failed"
             except Exception as e:
-                self.log(f"Error processing {fname}: {e}")
-            
-            self.processed_files += 1
-            self.queue.task_done()
+                self.log(f"Error processing {os.path.basename(file_path)}: {e}")
+                error = str(e)
+            finally:
+                if profiler:
+                    self._stop_profiler(job_id, profiler)
+
+            if error is None:
+                db.complete_task(task_id)
+                metrics.inc("files_processed")
+                done = True
+            else:
+                done = db.fail_task(task_id, error)
+                metrics.inc("files_failed" if done else "files_retried")
+            if done:
+                with self._state_lock:
+                    self.processed_files += 1
+                self.publish_progress()
             
-        self.status = "idle"
-        self.current_file = ""
-        # Invalidate cache when processing is complete
+            status = db.finish_job_if_complete(job_id)
+            if status:
+                self.log(f"Scan #{job_id} {'complete' if status == 'done' else 'finished with failures'}.")
+                self._dump_profile(job_id)
+                if status == 'done':
+                    self._api_keys.pop(job_id, None)
+
+    def _start_profiler(self):
+        """Start profiling this task, or return None if another thread already is.
+
+        Profiling is best effort: it must never fail the task being profiled.
+        """
+        if not self._profile_lock.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
         try:
-             from app.core.graph import graph_builder
-             graph_builder.invalidate_cache()
-        except ImportError:
-             pass
+            profiler.enable()
+        except ValueError as e:
+            # Another profiler (e.g. one attached from outside) is already active
+            self._profile_lock.release()
+            self.log(f"Profiling unavailable: {e}")
+            return None
+        return profiler
+
+    def _stop_profiler(self, job_id, profiler):
+        try:
+            profiler.disable()
+            self._add_profile(job_id, profiler)
+        except Exception as e:
+            self.log(f"Profiling failed: {e}")
+        finally:
+            self._profile_lock.release()
+
+    def _add_profile(self, job_id, profiler):
+        with self._state_lock:
+            if job_id in self._profiles:
+                self._profiles[job_id].add(profiler)
+            else:
+                self._profiles[job_id] = pstats.Stats(profiler)
+
+    def _dump_profile(self, job_id):
+        with self._state_lock:
+            stats = self._profiles.pop(job_id, None)
+        if stats is None:
+            return
+        os.makedirs(config.PROFILE_DIR, exist_ok=True)
+        path = os.path.join(config.PROFILE_DIR, f"scan_{job_id}.prof")
+        stats.dump_stats(path)
+        self.log(f"Profile for scan #{job_id} written to {path}")
 
+    def _finish(self):
+        # Called by the last worker thread, holding _state_lock
+        self.status = "idle"
+        self.current_file = ""
+        self.current_job = None
+        # The graph was patched item by item, so there is nothing left to invalidate
         if self._stop_event.is_set():
             self.log("Scan stopped by user.")
         else:
             self.log("Scan complete.")
+        self.publish_progress()
+
+    def process_file(self, file_path, use_llm=False, api_key="", model_id="gemini-1.5-flash-latest", provider="gemini", base_url="", library=DEFAULT_LIBRARY):
+        """Analyze a single file and store it in the library. Returns the item ID or None."""
+        try:
+            return self._analyze_and_store(file_path, use_llm, api_key, model_id, provider, base_url, library)
+        except Exception as e:
+            self.log(f"Error processing {os.path.basename(file_path)}: {e}")
+            return None
+
+    def _run_analysis(self, file_path, use_llm=False, api_key="", model_id="gemini-1.5-flash-latest", provider="gemini", base_url=""):
+        if inference_pool.enabled:
+            return inference_pool.analyze(file_path, use_llm, api_key, model_id, provider, base_url)
+        with self._analyze_lock:
+            return analyzer.analyze(file_path, use_llm, api_key, model_id, provider, base_url)
+
+    @staticmethod
+    def _record_stages(metadata):
+        for stage, seconds in metadata.get("stages", {}).items():
+            metrics.observe(stage, seconds)
+        if metadata.get("ocr_skipped"):
+            metrics.inc("ocr_skipped")
+
+    def _analyze_and_store(self, file_path, use_llm=False, api_key="", model_id="gemini-1.5-flash-latest", provider="gemini", base_url="", library=DEFAULT_LIBRARY):
+        target = libraries.get(library, create=True)
+        ext = os.path.splitext(file_path)[1].lower()
+        item_type = "text" if ext == ".txt" else "image"
+        fname = os.path.basename(file_path)
+
+        mtime = os.path.getmtime(file_path)
+        # Analyze
+        result = self._run_analysis(file_path, use_llm, api_key, model_id, provider, base_url)
+        if result:
+            # Check if it's an error from LLM
+            if "error" in result:
+                self._record_stages(result.get("metadata", {}))
+                metrics.inc("llm_failed")
+                err_reason = result["error"]
+                self.log(f"{provider.upper()} Failed for {fname}: {err_reason}. Falling back to local...")
+                # Run local fallback manually here to get actual content
+                result = self._run_analysis(file_path, use_llm=False)
+        if not result:
+            self.log(f"Analysis failed for {fname}")
+            return None
+
+        metadata = result.get("metadata", {})
+        method = metadata.get("method", "Unknown")
+        duration = metadata.get("duration", 0)
+        metrics.observe("analyze", duration)
+        self._record_stages(metadata)
+
+        self.log(f"{method}: Analyzed {fname} in {duration:.1f}s")
+
+        # If LLM/Analysis gave us tags, use them.
+        if 'tags' in result and result['tags']:
+            tags = result['tags']
+        else:
+            caption_graph = result.get('caption', "").lower().split()
+            ocr_graph = result.get('ocr_text', "").lower().split()
+
+            # Basic stop word removal (very basic)
+            stop_words = {'the', 'and', 'this', 'that', 'with', 'from', 'image', 'picture', 'photo'}
+            tags = list(set([w.strip(".,") for w in caption_graph + ocr_graph if len(w) > 3 and w not in stop_words]))
+
+        with metrics.timer("db_write"):
+            img_id = target.db.add_image(
+                path=file_path,
+                type=item_type,
+                thumbnail_path="", 
+                caption=result.get('caption', ""),
+                ocr_text=result.get('ocr_text', "") if item_type == "image" else result.get('content', ""),
+                embedding=result['embedding'],
+                tags=tags,
+                mtime=mtime
+            )
+        if img_id is not None:
+            target.graph.update_items([img_id])
+            self.log(f"Saved {fname} to graph.")
+        return img_id
 
     def stop_scan(self):
         if self.status == "scanning":
             self._stop_event.set()
-            # Clear remaining queue items
-            while not self.queue.empty():
-                try:
-                    self.queue.get_nowait()
-                    self.queue.task_done()
-                except queue.Empty:
-                    break
+            # Pause remaining jobs; their pending tasks stay queued for /resume
+            db.set_jobs_status(('pending', 'in_progress'), 'paused')
             self.log("Stopping scan...")
             return True
         return False
 
-    def get_progress(self):
-        return {
+    def get_progress(self, include_logs=True):
+        progress = {
             "status": self.status,
             "total": self.total_files,
             "processed": self.processed_files,
             "current": os.path.basename(self.current_file) if self.current_file else "",
-            "logs": self.logs
+            "job": self.current_job,
         }
+        if include_logs:
+            progress["logs"] = list(self.logs)
+        return progress
 
 worker = ScanWorker()
@@ -2,18 +2,38 @@ import sqlite3
 import json
 import numpy as np
 import os
+import threading
+from collections import OrderedDict
 from datetime import datetime
+from app.core import config
+from app.core.vectors import FORMATS, encode, decode
 
 # Get the directory of the current file (backend/app/db)
 current_dir = os.path.dirname(os.path.abspath(__file__))
 # Navigate up to the backend directory (backend/)
 backend_dir = os.path.dirname(os.path.dirname(os.path.dirname(current_dir)))
-DB_PATH = os.path.join(backend_dir, "db.sqlite")
+DB_PATH = os.environ.get("IMAGEGRAPH_DB_PATH", os.path.join(backend_dir, "db.sqlite"))
+
+# A task that fails this many times is marked failed instead of being re-queued
+MAX_TASK_ATTEMPTS = 3
+# Per-item write revisions remembered for caches that patch items in one by one
+WRITE_REVISIONS_KEPT = 10000
 
 
 class Storage:
-    def __init__(self):
-        self.conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    def __init__(self, db_path=DB_PATH, vector_format=None):
+        self.db_path = db_path
+        # Format new embeddings are written in; rows keep whatever format they were written with
+        self.vector_format = vector_format or config.VECTOR_FORMAT
+        if self.vector_format not in FORMATS:
+            raise ValueError(f"Unknown vector format: {self.vector_format!r}")
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        # Serializes writes, which come from API, scan and watcher threads
+        self._lock = threading.RLock()
+        # Bumped on every change to stored items so derived caches know to reload
+        self.revision = 0
+        # image_id -> revision produced by its latest add/delete (most recent writes only)
+        self._write_revisions = OrderedDict()
         self.create_tables()
 
     def create_tables(self):
@@ -42,6 +62,12 @@ class Storage:
             cursor.execute('ALTER TABLE images ADD COLUMN type TEXT DEFAULT "image"')
         except sqlite3.OperationalError:
             pass # Already exists
+
+        # File modification time, used by the watcher to detect changes (migration)
+        try:
+            cursor.execute('ALTER TABLE images ADD COLUMN mtime REAL')
+        except sqlite3.OperationalError:
+            pass # Already exists
         
         # Concepts/Tags table (for graph nodes)
         cursor.execute('''
@@ -61,21 +87,64 @@ class Storage:
                 FOREIGN KEY(image_id) REFERENCES images(id)
             )
         ''')
+
+        # Compact vector encoding (migration); NULL format means raw float32
+        for column in ('format TEXT', 'scale REAL'):
+            try:
+                cursor.execute(f'ALTER TABLE embeddings ADD COLUMN {column}')
+            except sqlite3.OperationalError:
+                pass # Already exists
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_embeddings_image ON embeddings(image_id)')
+
+        # Durable scan queue: one job per scanned root, one task per file
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS scan_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                root TEXT,
+                priority INTEGER DEFAULT 0,
+                status TEXT DEFAULT 'pending',
+                options TEXT,
+                created DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS scan_tasks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id INTEGER,
+                path TEXT,
+                status TEXT DEFAULT 'pending',
+                attempts INTEGER DEFAULT 0,
+                error TEXT,
+                FOREIGN KEY(job_id) REFERENCES scan_jobs(id)
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_scan_tasks_job_status ON scan_tasks(job_id, status)')
+        # Older versions stored the LLM API key with the job options (migration)
+        try:
+            cursor.execute("UPDATE scan_jobs SET options = json_remove(options, '$.api_key') WHERE options LIKE '%api_key%'")
+        except sqlite3.OperationalError:
+            pass # SQLite built without JSON support
         
         self.conn.commit()
 
-    def add_image(self, path, type, thumbnail_path, caption, ocr_text, embedding, tags):
-        cursor = self.conn.cursor()
-        try:
-            cursor.execute('''
-                INSERT OR IGNORE INTO images (path, type, thumbnail_path, caption, ocr_text, tags)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (path, type, thumbnail_path, caption, ocr_text, json.dumps(tags)))
+    def add_image(self, path, type, thumbnail_path, caption, ocr_text, embedding, tags, mtime=None):
+        with self._lock:
+            cursor = self.conn.cursor()
+            try:
+                # Upsert so re-analyzed (modified) files refresh their metadata
+                cursor.execute('''
+                    INSERT INTO images (path, type, thumbnail_path, caption, ocr_text, tags, mtime)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(path) DO UPDATE SET
+                        type = excluded.type,
+                        thumbnail_path = excluded.thumbnail_path,
+                        caption = excluded.caption,
+                        ocr_text = excluded.ocr_text,
+                        tags = excluded.tags,
+                        mtime = excluded.mtime
+                ''', (path, type, thumbnail_path, caption, ocr_text, json.dumps(tags), mtime))
             
-            # Get ID (if ignored, we need to fetch it)
-            if cursor.lastrowid:
-                img_id = cursor.lastrowid
-            else:
+                # lastrowid is not reliable after an upsert update, so look the ID up
                 cursor.execute('SELECT id FROM images WHERE path = ?', (path,))
                 result = cursor.fetchone()
                 if result:
@@ -83,23 +152,119 @@ class Storage:
                 else:
                     return None # Should not happen
 
-            # Store embedding
-            vector_blob = np.array(embedding, dtype=np.float32).tobytes()
-            # Check if embedding exists
-            cursor.execute('DELETE FROM embeddings WHERE image_id = ?', (img_id,))
-            cursor.execute('INSERT INTO embeddings (image_id, vector) VALUES (?, ?)', (img_id, vector_blob))
+                # Store embedding
+                vector_blob, scale = encode(embedding, self.vector_format)
+                # Check if embedding exists
+                cursor.execute('DELETE FROM embeddings WHERE image_id = ?', (img_id,))
+                cursor.execute(
+                    'INSERT INTO embeddings (image_id, vector, format, scale) VALUES (?, ?, ?, ?)',
+                    (img_id, vector_blob, self.vector_format, scale)
+                )
             
-            self.conn.commit()
-            return img_id
-        except Exception as e:
-            print(f"DB Error: {e}")
-            return None
+                self.conn.commit()
+                self._bump_revision(img_id)
+                return img_id
+            except Exception as e:
+                print(f"DB Error: {e}")
+                return None
 
     def get_all_images(self):
         cursor = self.conn.cursor()
         cursor.execute('SELECT id, path, caption, tags, type FROM images')
         return cursor.fetchall()
 
+    def count_images(self):
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT COUNT(*) FROM images')
+        return cursor.fetchone()[0]
+
+    def get_image_id_by_path(self, path):
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT id FROM images WHERE path = ?', (path,))
+        result = cursor.fetchone()
+        return result[0] if result else None
+
+    def get_mtime(self, path):
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT mtime FROM images WHERE path = ?', (path,))
+        result = cursor.fetchone()
+        return result[0] if result else None
+
+    def get_mtimes(self, root):
+        """Return {path: mtime} for every stored item under the given folder."""
+        prefix = os.path.join(os.path.abspath(root), "")
+        cursor = self.conn.cursor()
+        cursor.execute(
+            "SELECT path, mtime FROM images WHERE substr(path, 1, ?) = ?",
+            (len(prefix), prefix)
+        )
+        return {path: mtime for path, mtime in cursor.fetchall()}
+
+    def delete_image_by_path(self, path):
+        """Remove an item and its embedding. Returns the deleted ID or None."""
+        with self._lock:
+            cursor = self.conn.cursor()
+            cursor.execute('SELECT id FROM images WHERE path = ?', (path,))
+            result = cursor.fetchone()
+            if not result:
+                return None
+            img_id = result[0]
+            cursor.execute('DELETE FROM embeddings WHERE image_id = ?', (img_id,))
+            cursor.execute('DELETE FROM images WHERE id = ?', (img_id,))
+            self.conn.commit()
+            self._bump_revision(img_id)
+            return img_id
+
+    def _bump_revision(self, image_id):
+        # Caller holds _lock
+        self.revision += 1
+        self._write_revisions[image_id] = self.revision
+        self._write_revisions.move_to_end(image_id)
+        if len(self._write_revisions) > WRITE_REVISIONS_KEPT:
+            self._write_revisions.popitem(last=False)
+
+    def write_revision(self, image_id):
+        """Revision produced by the latest add or delete of image_id, or None if not known."""
+        with self._lock:
+            return self._write_revisions.get(image_id)
+
+    def get_embedding(self, image_id):
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT vector, format, scale FROM embeddings WHERE image_id = ?', (image_id,))
+        result = cursor.fetchone()
+        return decode(*result) if result else None
+
+    def get_embeddings(self, image_ids):
+        """Return {image_id: float32 vector} for the given IDs."""
+        image_ids = [int(i) for i in image_ids]
+        found = {}
+        cursor = self.conn.cursor()
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(image_ids), 900):
+            chunk = image_ids[start:start + 900]
+            cursor.execute(
+                f'SELECT image_id, vector, format, scale FROM embeddings WHERE image_id IN ({",".join("?" * len(chunk))})',
+                chunk
+            )
+            for image_id, blob, fmt, scale in cursor.fetchall():
+                found[image_id] = decode(blob, fmt, scale)
+        return found
+
+    def iter_embeddings(self, batch_size=10000):
+        """Yield (ids, float32 matrix) batches so callers never decode every vector at once."""
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT image_id, vector, format, scale FROM embeddings')
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield [r[0] for r in rows], np.array([decode(r[1], r[2], r[3]) for r in rows])
+
+    def embedding_bytes(self):
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings')
+        return cursor.fetchone()[0]
+
     def get_image_by_id(self, image_id):
         cursor = self.conn.cursor()
         cursor.execute('SELECT id, path, caption, tags, type FROM images WHERE id = ?', (image_id,))
@@ -108,20 +273,192 @@ class Storage:
     
     def get_all_embeddings(self):
         cursor = self.conn.cursor()
-        cursor.execute('SELECT image_id, vector FROM embeddings')
+        cursor.execute('SELECT image_id, vector, format, scale FROM embeddings')
         rows = cursor.fetchall()
         ids = []
         vecs = []
         for r in rows:
             ids.append(r[0])
-            vecs.append(np.frombuffer(r[1], dtype=np.float32))
+            vecs.append(decode(r[1], r[2], r[3]))
         return ids, np.array(vecs) if vecs else np.empty((0, 512)) # CLIP is 512d
 
+    # --- Scan job queue ---
+
+    def create_job(self, root, paths, options, priority=0):
+        with self._lock:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                'INSERT INTO scan_jobs (root, priority, status, options) VALUES (?, ?, ?, ?)',
+                (root, priority, 'pending', json.dumps(options))
+            )
+            job_id = cursor.lastrowid
+            cursor.executemany(
+                'INSERT INTO scan_tasks (job_id, path) VALUES (?, ?)',
+                [(job_id, p) for p in paths]
+            )
+            if not paths:
+                cursor.execute("UPDATE scan_jobs SET status = 'done' WHERE id = ?", (job_id,))
+            self.conn.commit()
+            return job_id
+
+    def claim_next_task(self):
+        """Mark the next pending task in_progress and return (task_id, job_id, path, options).
+
+        Higher priority jobs go first, then older jobs; retried tasks go to the back of their job.
+        """
+        with self._lock:
+            cursor = self.conn.cursor()
+            cursor.execute('''
+                SELECT t.id, t.job_id, t.path, j.options FROM scan_tasks t
+                JOIN scan_jobs j ON j.id = t.job_id
+                WHERE t.status = 'pending' AND j.status IN ('pending', 'in_progress')
+                ORDER BY j.priority DESC, j.id ASC, t.attempts ASC, t.id ASC
+                LIMIT 1
+            ''')
+            row = cursor.fetchone()
+            if not row:
+                return None
+            task_id, job_id, path, options = row
+            cursor.execute("UPDATE scan_tasks SET status = 'in_progress' WHERE id = ?", (task_id,))
+            cursor.execute("UPDATE scan_jobs SET status = 'in_progress' WHERE id = ? AND status = 'pending'", (job_id,))
+            self.conn.commit()
+            return task_id, job_id, path, json.loads(options) if options else {}
+
+    def complete_task(self, task_id):
+        with self._lock:
+            cursor = self.conn.cursor()
+            cursor.execute("UPDATE scan_tasks SET status = 'done', error = NULL WHERE id = ?", (task_id,))
+            self.conn.commit()
+
+    def fail_task(self, task_id, error=""):
+        """Re-queue a failed task, or mark it failed once it has used up its attempts.
+
+        Returns True if the task is permanently failed.
+        """
+        with self._lock:
+            cursor = self.conn.cursor()
+            cursor.execute('''
+                UPDATE scan_tasks
+                SET attempts = attempts + 1,
+                    error = ?,
+                    status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END
+                WHERE id = ?
+            ''', (error, MAX_TASK_ATTEMPTS, task_id))
+            self.conn.commit()
+            cursor.execute('SELECT status FROM scan_tasks WHERE id = ?', (task_id,))
+            result = cursor.fetchone()
+            return bool(result) and result[0] == 'failed'
+
+    def finish_job_if_complete(self, job_id):
+        """Close a job once it has no pending or running tasks. Returns the final status or None."""
+        with self._lock:
+            cursor = self.conn.cursor()
+            cursor.execute('''
+                SELECT
+                    SUM(status IN ('pending', 'in_progress')),
+                    SUM(status = 'failed')
+                FROM scan_tasks WHERE job_id = ?
+            ''', (job_id,))
+            open_count, failed_count = cursor.fetchone()
+            if open_count:
+                return None
+            status = 'failed' if failed_count else 'done'
+            cursor.execute(
+                "UPDATE scan_jobs SET status = ? WHERE id = ? AND status IN ('pending', 'in_progress')",
+                (status, job_id)
+            )
+            self.conn.commit()
+            return status
+
+    def requeue_interrupted_tasks(self):
+        """Return tasks left in_progress by a crash to the queue, counting the interrupted attempt."""
+        with self._lock:
+            cursor = self.conn.cursor()
+            cursor.execute('''
+                UPDATE scan_tasks
+                SET attempts = attempts + 1,
+                    status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END
+                WHERE status = 'in_progress'
+            ''', (MAX_TASK_ATTEMPTS,))
+            self.conn.commit()
+            return cursor.rowcount
+
+    def count_pending_tasks(self):
+        with self._lock:
+            cursor = self.conn.cursor()
+            cursor.execute('''
+                SELECT COUNT(*) FROM scan_tasks t JOIN scan_jobs j ON j.id = t.job_id
+                WHERE t.status IN ('pending', 'in_progress') AND j.status IN ('pending', 'in_progress')
+            ''')
+            return cursor.fetchone()[0]
+
+    def set_jobs_status(self, from_statuses, to_status, job_id=None):
+        """Move jobs between states (pause/resume/cancel). Returns the number of jobs changed."""
+        with self._lock:
+            cursor = self.conn.cursor()
+            query = f"UPDATE scan_jobs SET status = ? WHERE status IN ({','.join('?' * len(from_statuses))})"
+            params = [to_status, *from_statuses]
+            if job_id is not None:
+                query += ' AND id = ?'
+                params.append(job_id)
+            cursor.execute(query, params)
+            self.conn.commit()
+            return cursor.rowcount
+
+    def retry_failed_tasks(self, job_id):
+        """Re-queue a job's failed tasks with a fresh retry budget. Returns how many were re-queued."""
+        with self._lock:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                "UPDATE scan_tasks SET status = 'pending', attempts = 0 WHERE job_id = ? AND status = 'failed'",
+                (job_id,)
+            )
+            count = cursor.rowcount
+            if count:
+                cursor.execute("UPDATE scan_jobs SET status = 'pending' WHERE id = ?", (job_id,))
+            self.conn.commit()
+            return count
+
+    def get_jobs(self):
+        with self._lock:
+            cursor = self.conn.cursor()
+            cursor.execute('''
+                SELECT j.id, j.root, j.priority, j.status, j.created, j.options,
+                    COUNT(t.id),
+                    COALESCE(SUM(t.status = 'pending'), 0),
+                    COALESCE(SUM(t.status = 'in_progress'), 0),
+                    COALESCE(SUM(t.status = 'done'), 0),
+                    COALESCE(SUM(t.status = 'failed'), 0)
+                FROM scan_jobs j LEFT JOIN scan_tasks t ON t.job_id = j.id
+                GROUP BY j.id ORDER BY j.id DESC
+            ''')
+            return [
+                {
+                    "id": r[0], "root": r[1], "priority": r[2], "status": r[3], "created": r[4],
+                    "library": json.loads(r[5] or "{}").get("library", "default"),
+                    "total": r[6], "pending": r[7], "in_progress": r[8], "done": r[9], "failed": r[10]
+                }
+                for r in cursor.fetchall()
+            ]
+
+    def get_failed_tasks(self, job_id):
+        with self._lock:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                "SELECT path, attempts, error FROM scan_tasks WHERE job_id = ? AND status = 'failed'",
+                (job_id,)
+            )
+            return [{"path": r[0], "attempts": r[1], "error": r[2]} for r in cursor.fetchall()]
+
     def clear_database(self):
-        cursor = self.conn.cursor()
-        cursor.execute('DELETE FROM embeddings')
-        cursor.execute('DELETE FROM concepts')
-        cursor.execute('DELETE FROM images')
-        self.conn.commit()
+        # Items only: the job queue lives in the default database and serves every library
+        with self._lock:
+            cursor = self.conn.cursor()
+            cursor.execute('DELETE FROM embeddings')
+            cursor.execute('DELETE FROM concepts')
+            cursor.execute('DELETE FROM images')
+            self.conn.commit()
+            self.revision += 1
+            self._write_revisions.clear()
 
 db = Storage()
@@ -1,15 +1,24 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 from pydantic import BaseModel
+from typing import Optional
 import os
 import json
 import io
+import threading
 from PIL import Image
-from fastapi.responses import FileResponse, Response
+from fastapi.responses import FileResponse, Response, StreamingResponse, PlainTextResponse
+import asyncio
 from app.core.worker import worker
-from app.core.graph import graph_builder
+from app.core.watcher import watcher
+from app.core.analyzer import analyzer
+from app.core.inference import inference_pool
+from app.core import config
+from app.core.library import libraries, DEFAULT_LIBRARY
+from app.core.events import event_bus
+from app.core.metrics import metrics
 from app.db.storage import db
 
 app = FastAPI(title="ImageGraph API")
@@ -30,21 +39,128 @@ class ScanRequest(BaseModel):
     model_id: str = "gemini-1.5-flash-latest"
     provider: str = "gemini"
     base_url: str = ""
+    priority: int = 0
+    profile: bool = False
+    library: str = DEFAULT_LIBRARY
+
+@app.on_event("startup")
+def resume_scan_jobs():
+    if config.MODE == "viewer":
+        return
+    # Pick up jobs left unfinished by a crash or restart; paused jobs wait for /resume
+    worker.recover()
+
+@app.on_event("startup")
+def warm_up_models():
+    if not config.WARMUP or config.MODE == "viewer":
+        return
+    if inference_pool.enabled:
+        # Each inference process warms up its own models
+        inference_pool.start()
+    else:
+        threading.Thread(target=analyzer.warm_up, daemon=True).start()
+
+@app.on_event("shutdown")
+def stop_inference_pool():
+    inference_pool.shutdown()
 
 @app.get("/")
 def read_root():
     return {"message": "ImageGraph Backend is running"}
 
+def _require_full_mode():
+    if config.MODE == "viewer":
+        raise HTTPException(status_code=403, detail="Not available in viewer mode")
+
+def _library(name, create=False):
+    try:
+        return libraries.get(name, create=create)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Library not found")
+
+@app.get("/libraries")
+def list_libraries():
+    return {"libraries": [
+        {"name": name, "items": libraries.get(name).db.count_images()} for name in libraries.names()
+    ]}
+
 @app.post("/scan")
 def scan_folder(request: ScanRequest, background_tasks: BackgroundTasks):
+    _require_full_mode()
     if not os.path.isdir(request.path):
         raise HTTPException(status_code=400, detail="Invalid directory path")
+    _library(request.library, create=True)
     
-    started = worker.start_scan(request.path, request.use_llm, request.api_key, request.model_id, request.provider, request.base_url)
-    if not started:
-        raise HTTPException(status_code=409, detail="Scan already in progress")
+    job_id = worker.start_scan(request.path, request.use_llm, request.api_key, request.model_id, request.provider, request.base_url, request.priority, request.profile, request.library)
         
-    return {"status": "Scan started", "path": request.path, "llm": request.use_llm, "model": request.model_id, "provider": request.provider}
+    return {"status": "Scan started", "path": request.path, "job_id": job_id, "library": request.library, "llm": request.use_llm, "model": request.model_id, "provider": request.provider}
+
+@app.get("/jobs")
+def list_jobs():
+    return {"jobs": db.get_jobs()}
+
+@app.get("/jobs/{job_id}/failed")
+def list_failed_tasks(job_id: int):
+    return {"failed": db.get_failed_tasks(job_id)}
+
+class ResumeRequest(BaseModel):
+    # API keys are never stored with jobs, so LLM jobs need theirs again after a restart
+    api_key: str = ""
+
+@app.post("/jobs/{job_id}/retry")
+def retry_job(job_id: int, request: Optional[ResumeRequest] = None):
+    _require_full_mode()
+    count = db.retry_failed_tasks(job_id)
+    if not count:
+        raise HTTPException(status_code=404, detail="No failed tasks for this job")
+    if request:
+        worker.set_api_key(job_id, request.api_key)
+    worker.ensure_running(added=count)
+    return {"status": "Retrying", "job_id": job_id, "tasks": count}
+
+@app.post("/jobs/{job_id}/cancel")
+def cancel_job(job_id: int):
+    if not db.set_jobs_status(('pending', 'in_progress', 'paused'), 'cancelled', job_id):
+        raise HTTPException(status_code=404, detail="No active job with this ID")
+    return {"status": "Cancelled", "job_id": job_id}
+
+@app.post("/resume")
+def resume_scan(request: Optional[ResumeRequest] = None):
+    _require_full_mode()
+    if not worker.resume(request.api_key if request else ""):
+        raise HTTPException(status_code=400, detail="Nothing to resume")
+    return {"status": "Scan resumed"}
+
+class WatchRequest(ScanRequest):
+    poll: bool = False
+
+class UnwatchRequest(BaseModel):
+    path: str
+
+@app.post("/watch")
+def watch_folder(request: WatchRequest):
+    _require_full_mode()
+    if not os.path.isdir(request.path):
+        raise HTTPException(status_code=400, detail="Invalid directory path")
+    _library(request.library, create=True)
+
+    started = watcher.watch(request.path, request.use_llm, request.api_key, request.model_id, request.provider, request.base_url, request.poll, request.library)
+    if not started:
+        raise HTTPException(status_code=409, detail="Folder is already being watched")
+
+    return {"status": "Watching", "path": request.path, "watches": watcher.list_watches()}
+
+@app.get("/watch")
+def list_watches():
+    return {"watches": watcher.list_watches()}
+
+@app.post("/unwatch")
+def unwatch_folder(request: UnwatchRequest):
+    if not watcher.unwatch(request.path):
+        raise HTTPException(status_code=404, detail="Folder is not being watched")
+    return {"status": "Stopped watching", "path": request.path}
 
 class ModelRequest(BaseModel):
     api_key: str = ""
@@ -95,19 +211,52 @@ def stop_scan():
 
 @app.get("/progress")
 def get_progress():
-    return worker.get_progress()
+    return {**worker.get_progress(), "metrics": metrics.summary()}
+
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/events")
+async def stream_events(request: Request):
+    """Server-Sent Events: progress counters, new log lines and graph deltas as they happen."""
+    sub = event_bus.subscribe()
+    _, q = sub
+
+    async def generate():
+        try:
+            # Start every client from the current state
+            yield event_bus.format_sse("progress", worker.get_progress())
+            while not await request.is_disconnected():
+                try:
+                    event_type, data = await asyncio.wait_for(q.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield event_bus.format_sse(event_type, data)
+        finally:
+            event_bus.unsubscribe(sub)
+
+    return StreamingResponse(generate(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.get("/graph")
-def get_graph(sim_threshold: float = 0.7):
-    # Update threshold if needed in builder (naive implementation)
-    graph_builder.sim_threshold = sim_threshold
-    elements = graph_builder.export_cytoscape()
-    return {"elements": elements}
+def get_graph(sim_threshold: float = 0.7, layout: bool = False, collapse: bool = False, expand: str = "",
+              library: str = DEFAULT_LIBRARY):
+    """Graph elements of one library; layout=true adds server-computed positions and communities,
+    collapse=true folds large communities (except the comma-separated ids in expand) into summary nodes."""
+    graph = _library(library).graph
+    graph.set_sim_threshold(sim_threshold)
+    expanded = {int(c) for c in expand.split(",") if c.strip().isdigit()}
+    elements, version = graph.export_snapshot(with_layout=layout, collapse=collapse, expand=expanded)
+    with metrics.timer("graph_serialize"):
+        body = json.dumps({"elements": elements, "version": version, "library": library})
+    return Response(content=body, media_type="application/json")
 
 @app.get("/image/{image_id}")
-def get_image_metadata(image_id: int):
+def get_image_metadata(image_id: int, library: str = DEFAULT_LIBRARY):
     # Retrieve directly from DB using image_id
-    img = db.get_image_by_id(image_id)
+    img = _library(library).db.get_image_by_id(image_id)
     if img:
         return {
             "id": img[0],
@@ -119,11 +268,15 @@ def get_image_metadata(image_id: int):
 
 from functools import lru_cache
 
+# Lets get_thumbnail tell a cache hit from a miss for the metrics
+_thumbnail_state = threading.local()
+
 @lru_cache(maxsize=500)
 def _generate_thumbnail_bytes(image_path: str, mtime: float) -> bytes:
     """Generate and cache thumbnail bytes. mtime ensures cache invalidation on file change."""
+    _thumbnail_state.generated = True
     try:
-        with Image.open(image_path) as pil_img:
+        with metrics.timer("thumbnail"), Image.open(image_path) as pil_img:
             pil_img.thumbnail((128, 128))
             img_byte_arr = io.BytesIO()
             # Save as JPEG for better compression/speed
@@ -134,14 +287,16 @@ def _generate_thumbnail_bytes(image_path: str, mtime: float) -> bytes:
         return None
 
 @app.get("/thumbnail/{image_id}")
-def get_thumbnail(image_id: int):
-    img = db.get_image_by_id(image_id)
+def get_thumbnail(image_id: int, library: str = DEFAULT_LIBRARY):
+    img = _library(library).db.get_image_by_id(image_id)
     if not img or not os.path.exists(img[1]):
         raise HTTPException(status_code=404, detail="Image not found")
     
     try:
         mtime = os.path.getmtime(img[1])
+        _thumbnail_state.generated = False
         thumbnail_bytes = _generate_thumbnail_bytes(img[1], mtime)
+        metrics.inc("thumbnail_cache_miss" if _thumbnail_state.generated else "thumbnail_cache_hit")
         if thumbnail_bytes:
              return Response(content=thumbnail_bytes, media_type="image/jpeg", 
                             headers={"Cache-Control": "public, max-age=31536000"})
@@ -151,8 +306,8 @@ def get_thumbnail(image_id: int):
         raise HTTPException(status_code=500, detail=f"Error generating thumbnail: {str(e)}")
 
 @app.get("/image_content/{image_id}")
-def get_image_content(image_id: int):
-    images = db.get_all_images()
+def get_image_content(image_id: int, library: str = DEFAULT_LIBRARY):
+    images = _library(library).db.get_all_images()
     for img in images:
         if img[0] == image_id:
              if os.path.exists(img[1]):
@@ -160,14 +315,39 @@ def get_image_content(image_id: int):
     raise HTTPException(status_code=404, detail="Image not found")
 
 @app.get("/export")
-def export_graph():
-    elements = graph_builder.export_cytoscape()
-    return {"graph": elements}
+def export_graph(library: str = DEFAULT_LIBRARY):
+    elements = _library(library).graph.export_cytoscape()
+    return {"graph": elements, "library": library}
+
+@app.get("/similar/{image_id}")
+def similar_items(image_id: int, library: str = DEFAULT_LIBRARY, k: int = 10, across: str = ""):
+    """Nearest items to an item by embedding. By default only its own library is searched;
+    across="*" searches every library, or pass a comma-separated list of library names."""
+    vector = _library(library).db.get_embedding(image_id)
+    if vector is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    if across == "*":
+        names = libraries.names()
+    else:
+        names = [n.strip() for n in across.split(",") if n.strip()] or [library]
+    for name in names:
+        _library(name)
+
+    results = []
+    for r in libraries.similar(vector, k, names, exclude=(library, image_id)):
+        img = libraries.get(r["library"]).db.get_image_by_id(r["id"])
+        if img:  # Skip items deleted since the index was loaded
+            results.append({**r, "path": img[1], "caption": img[2], "type": img[4]})
+    return {"results": results}
 
 @app.post("/reset")
-def reset_database():
+def reset_database(library: str = DEFAULT_LIBRARY):
+    _require_full_mode()
     if worker.status == "scanning":
         raise HTTPException(status_code=409, detail="Cannot reset while scanning")
-    db.clear_database()
+    target = _library(library)
+    target.db.clear_database()
+    target.graph.invalidate_cache()
+    event_bus.publish("resync", {"library": library})
     return {"status": "Database cleared"}
 
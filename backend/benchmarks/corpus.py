@@ -0,0 +1,82 @@
+"""Synthetic corpus generators for the benchmark suite.
+
+Everything is driven by a numpy Generator so a given seed always produces the same corpus.
+"""
+import os
+import numpy as np
+from PIL import Image
+
+WORDS = (
+    "receipt invoice total coffee street beach mountain forest river sunset cat dog car "
+    "train bridge garden kitchen table window office meeting notes project budget travel "
+    "ticket museum market flower summer winter snow city night light book music sport"
+).split()
+
+
+def random_embeddings(n, rng, dim=512, cluster_size=20, spread=0.35):
+    """Unit vectors scattered around cluster centres, so similarity edges actually form.
+
+    Items in one cluster are above the default 0.7 threshold of each other, so the
+    number of clusters grows with n to keep the edge count linear in n.
+    """
+    clusters = max(1, -(-n // cluster_size))
+    centres = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=n)
+    vecs = centres[labels] + spread * rng.standard_normal((n, dim)).astype(np.float32)
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+    return vecs
+
+
+def zipf_tags(n, rng, vocab_size=5000, per_item=(3, 8), a=1.3):
+    """Tag lists whose frequencies follow a Zipf distribution, like real captions/OCR words."""
+    vocab = [f"tag{i}" for i in range(vocab_size)]
+    tags = []
+    for _ in range(n):
+        k = int(rng.integers(per_item[0], per_item[1] + 1))
+        ranks = np.minimum(rng.zipf(a, size=k), vocab_size) - 1
+        tags.append(sorted({vocab[r] for r in ranks}))
+    return tags
+
+
+def populate_storage(storage, n, rng, prefix="/bench"):
+    """Insert n synthetic items. Returns the inserted IDs."""
+    embeddings = random_embeddings(n, rng)
+    tags = zipf_tags(n, rng)
+    ids = []
+    for i in range(n):
+        ids.append(storage.add_image(
+            path=f"{prefix}/item_{i}.jpg",
+            type="image",
+            thumbnail_path="",
+            caption=f"synthetic item {i}",
+            ocr_text="",
+            embedding=embeddings[i],
+            tags=tags[i]
+        ))
+    return ids
+
+
+def write_images(folder, n, rng, size=(640, 480)):
+    """Write n noisy gradient JPEGs (cheap to make, realistic to decode and thumbnail)."""
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    gradient = np.linspace(0, 255, size[0], dtype=np.float32)[None, :, None]
+    for i in range(n):
+        tint = rng.integers(0, 255, size=3).astype(np.float32)
+        noise = rng.normal(0, 20, size=(size[1], size[0], 3)).astype(np.float32)
+        pixels = np.clip(gradient * 0.5 + tint * 0.5 + noise, 0, 255).astype(np.uint8)
+        path = os.path.join(folder, f"image_{i}.jpg")
+        Image.fromarray(pixels).save(path, quality=85)
+        paths.append(path)
+    return paths
+
+
+def write_text_files(folder, n, rng, words_per_file=500):
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for i in range(n):
+        path = os.path.join(folder, f"note_{i}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(" ".join(rng.choice(WORDS, size=words_per_file)))
+        paths.append(path)
+    return paths
@@ -0,0 +1,278 @@
+"""Reproducible benchmarks for graph build, storage, API latency and scan throughput.
+
+Run from the backend directory:
+
+    python -m benchmarks.run --sizes 1000,10000,100000 --output bench.json
+
+Results are written as JSON so runs can be diffed or plotted against each other.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from benchmarks.corpus import (
+    populate_storage, random_embeddings, write_images, write_text_files
+)
+
+
+def _timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def _latency_stats(samples):
+    ms = np.array(samples) * 1000.0
+    return {
+        "requests": len(samples),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+    }
+
+
+def bench_storage(n, seed, workdir):
+    from app.db.storage import Storage
+    storage = Storage(os.path.join(workdir, f"storage_{n}.sqlite"))
+    rng = np.random.default_rng(seed)
+
+    seconds, _ = _timed(populate_storage, storage, n, rng)
+    results = [{"name": "storage.insert", "n": n, "seconds": seconds, "items_per_sec": n / seconds}]
+
+    seconds, (ids, vecs) = _timed(storage.get_all_embeddings)
+    results.append({"name": "storage.get_all_embeddings", "n": n, "seconds": seconds,
+                    "bytes": int(vecs.nbytes), "stored_bytes": storage.embedding_bytes(),
+                    "format": storage.vector_format})
+    return storage, results
+
+
+def estimate_edges(storage, n, sim_threshold, sample=2000):
+    """Estimate similarity edges from the pair density of a sample of stored vectors."""
+    from app.core.vectors import normalize
+    ids, vecs = next(storage.iter_embeddings(batch_size=sample), ([], None))
+    m = len(ids)
+    if m < 2:
+        return 0
+    normed = normalize(vecs)
+    above = int(np.count_nonzero(np.triu(normed @ normed.T, 1) >= sim_threshold))
+    return int(above / (m * (m - 1) / 2) * n * (n - 1) / 2)
+
+
+def bench_graph(storage, n, sim_threshold, max_edges):
+    from app.core.graph import GraphBuilder
+    # Similarity blocks keep the matrix out of memory, but every edge still lives in networkx
+    edges = estimate_edges(storage, n, sim_threshold)
+    if edges > max_edges:
+        reason = f"~{edges} similarity edges expected (> --max-edges {max_edges})"
+        return [{"name": name, "n": n, "skipped": reason}
+                for name in ("graph.build", "graph.export_cytoscape", "graph.serialize")]
+
+    builder = GraphBuilder(sim_threshold=sim_threshold, storage=storage)
+    seconds, G = _timed(builder.build_graph)
+    results = [{"name": "graph.build", "n": n, "seconds": seconds,
+                "nodes": G.number_of_nodes(), "edges": G.number_of_edges(),
+                "vector_bytes": builder.index.vectors().nbytes}]
+
+    # The graph is cached now, so this measures conversion to cytoscape elements only
+    seconds, elements = _timed(builder.export_cytoscape)
+    results.append({"name": "graph.export_cytoscape", "n": n, "seconds": seconds,
+                    "elements": len(elements)})
+
+    seconds, payload = _timed(json.dumps, {"elements": elements})
+    results.append({"name": "graph.serialize", "n": n, "seconds": seconds, "bytes": len(payload)})
+    return results
+
+
+def bench_api(n, seed, workdir, clients, requests_per_client, real_images):
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.db.storage import db
+    from app.core.graph import graph_builder
+
+    rng = np.random.default_rng(seed)
+    db.clear_database()
+    graph_builder.invalidate_cache()
+    image_paths = write_images(os.path.join(workdir, "api_images"), real_images, rng, size=(1024, 768))
+    embeddings = random_embeddings(len(image_paths), rng)
+    thumb_ids = [
+        db.add_image(path=p, type="image", thumbnail_path="", caption="", ocr_text="",
+                     embedding=embeddings[i], tags=["bench"])
+        for i, p in enumerate(image_paths)
+    ]
+    if n > real_images:
+        populate_storage(db, n - real_images, rng, prefix=os.path.join(workdir, "synthetic"))
+
+    def run(make_url):
+        samples = []
+        lock = threading.Lock()
+
+        def client_loop(client_idx):
+            client = TestClient(app)
+            local = []
+            for i in range(requests_per_client):
+                url = make_url(client_idx, i)
+                start = time.perf_counter()
+                response = client.get(url)
+                local.append(time.perf_counter() - start)
+                assert response.status_code == 200, f"{url}: {response.status_code}"
+            with lock:
+                samples.extend(local)
+
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            list(pool.map(client_loop, range(clients)))
+        return samples
+
+    results = []
+    client = TestClient(app)
+    seconds, _ = _timed(client.get, "/graph")
+    results.append({"name": "api.graph.cold", "n": n, "seconds": seconds})
+    results.append({"name": "api.graph", "n": n, "clients": clients,
+                    **_latency_stats(run(lambda c, i: "/graph"))})
+
+    # First pass generates every thumbnail, later passes are served from the cache
+    cold = run(lambda c, i: f"/thumbnail/{thumb_ids[(c * requests_per_client + i) % len(thumb_ids)]}")
+    results.append({"name": "api.thumbnail.cold", "n": len(thumb_ids), "clients": clients,
+                    **_latency_stats(cold)})
+    warm = run(lambda c, i: f"/thumbnail/{thumb_ids[i % len(thumb_ids)]}")
+    results.append({"name": "api.thumbnail.warm", "n": len(thumb_ids), "clients": clients,
+                    **_latency_stats(warm)})
+    return results
+
+
+class StubAnalyzer:
+    """Stands in for ImageAnalyzer so scan throughput excludes model inference."""
+
+    def __init__(self, seed, latency=0.0):
+        self.rng = np.random.default_rng(seed)
+        self.latency = latency
+
+    def analyze(self, file_path, use_llm=False, *args, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        result = {
+            "caption": f"stub caption for {os.path.basename(file_path)}",
+            "ocr_text": "",
+            "embedding": random_embeddings(1, self.rng)[0].tolist(),
+            "tags": [f"tag{int(t)}" for t in self.rng.zipf(1.3, size=5)],
+            "metadata": {"duration": self.latency, "method": "Stub"},
+        }
+        if file_path.endswith(".txt"):
+            result["content"] = ""
+        return result
+
+
+def bench_scan(n, seed, workdir, stub_latency, timeout=3600):
+    import app.core.worker as worker_module
+    from app.core.inference import InferencePool
+
+    rng = np.random.default_rng(seed)
+    folder = os.path.join(workdir, f"scan_{n}")
+    write_images(folder, n // 2, rng, size=(320, 240))
+    write_text_files(folder, n - n // 2, rng)
+
+    worker_module.analyzer = StubAnalyzer(seed, stub_latency)
+    worker_module.inference_pool = InferencePool(0)
+    worker = worker_module.worker
+
+    start = time.perf_counter()
+    worker.start_scan(folder)
+    while worker.status == "scanning":
+        if time.perf_counter() - start > timeout:
+            worker.stop_scan()
+            break
+        time.sleep(0.05)
+    seconds = time.perf_counter() - start
+    return [{"name": "scan.throughput", "n": n, "seconds": seconds,
+             "processed": worker.processed_files,
+             "items_per_sec": worker.processed_files / seconds,
+             "stub_latency_ms": stub_latency * 1000}]
+
+
+def _meta(args):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "args": vars(args),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ImageGraph benchmark suite")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="Comma-separated corpus sizes")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--sim-threshold", type=float, default=0.7)
+    parser.add_argument("--max-edges", type=int, default=5_000_000,
+                        help="Skip graph builds expected to produce more similarity edges than this")
+    parser.add_argument("--vector-format", default="float32", choices=("float32", "float16", "int8"),
+                        help="Embedding storage format (IMAGEGRAPH_VECTOR_FORMAT)")
+    parser.add_argument("--vector-index-format", choices=("float32", "float16", "int8"),
+                        help="In-memory vector format (IMAGEGRAPH_VECTOR_INDEX_FORMAT), defaults to --vector-format")
+    parser.add_argument("--vector-dim", type=int, default=0,
+                        help="PCA dimensions for in-memory vectors, 0 keeps full size (IMAGEGRAPH_VECTOR_DIM)")
+    parser.add_argument("--api-items", type=int, default=1000)
+    parser.add_argument("--api-images", type=int, default=100, help="Real image files used for /thumbnail")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=25, help="Requests per client")
+    parser.add_argument("--scan-files", type=int, default=500)
+    parser.add_argument("--stub-latency-ms", type=float, default=0.0,
+                        help="Simulated inference time per file for the scan benchmark")
+    parser.add_argument("--only", default="storage,graph,api,scan",
+                        help="Comma-separated subset of benchmarks to run")
+    parser.add_argument("--output", help="Write JSON results here instead of stdout")
+    args = parser.parse_args(argv)
+
+    selected = set(args.only.split(","))
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+
+    with tempfile.TemporaryDirectory(prefix="imagegraph-bench-") as workdir:
+        # Keep the app's module-level Storage away from the real database
+        os.environ["IMAGEGRAPH_DB_PATH"] = os.path.join(workdir, "app.sqlite")
+        # Read by app.core.config, which is only imported once the benchmarks start
+        os.environ["IMAGEGRAPH_VECTOR_FORMAT"] = args.vector_format
+        os.environ["IMAGEGRAPH_VECTOR_INDEX_FORMAT"] = args.vector_index_format or args.vector_format
+        os.environ["IMAGEGRAPH_VECTOR_DIM"] = str(args.vector_dim)
+
+        results = []
+        for n in sizes:
+            if selected & {"storage", "graph"}:
+                print(f"storage/graph n={n}...", file=sys.stderr)
+                storage, storage_results = bench_storage(n, args.seed, workdir)
+                if "storage" in selected:
+                    results.extend(storage_results)
+                if "graph" in selected:
+                    results.extend(bench_graph(storage, n, args.sim_threshold, args.max_edges))
+                storage.conn.close()
+        if "api" in selected:
+            print(f"api n={args.api_items}...", file=sys.stderr)
+            results.extend(bench_api(args.api_items, args.seed, workdir, args.clients,
+                                     args.requests, args.api_images))
+        if "scan" in selected:
+            print(f"scan n={args.scan_files}...", file=sys.stderr)
+            results.extend(bench_scan(args.scan_files, args.seed, workdir, args.stub_latency_ms / 1000))
+
+    report = json.dumps({"meta": _meta(args), "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
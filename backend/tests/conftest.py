@@ -0,0 +1,9 @@
+import os
+import tempfile
+
+# Point the app at throwaway storage before any test imports it, so running the
+# suite never touches the developer's db.sqlite, libraries or profiles
+_root = tempfile.mkdtemp(prefix="imagegraph-tests-")
+os.environ["IMAGEGRAPH_DB_PATH"] = os.path.join(_root, "db.sqlite")
+os.environ["IMAGEGRAPH_LIBRARY_DIR"] = os.path.join(_root, "libraries")
+os.environ["IMAGEGRAPH_PROFILE_DIR"] = os.path.join(_root, "profiles")
@@ -0,0 +1,123 @@
+from PIL import Image
+from app.core import analyzer as analyzer_module
+import numpy as np
+from app.core.analyzer import ImageAnalyzer, _chunk_text, _downscale
+
+
+class FakeReader:
+    def __init__(self):
+        self.calls = []
+
+    def readtext(self, image, detail=0):
+        self.calls.append(image)
+        return ["TOTAL", "12.50"]
+
+
+def test_downscale_keeps_aspect_ratio():
+    image = Image.new('RGB', (4000, 1000))
+    small = _downscale(image, 1000)
+    assert small.size == (1000, 250)
+    # Images already small enough are returned unchanged
+    assert _downscale(small, 2000) is small
+
+
+def test_ocr_skipped_when_clip_gate_finds_no_text(monkeypatch):
+    monkeypatch.setattr(analyzer_module.config, "OCR_GATE", "clip")
+    analyzer = ImageAnalyzer()
+    analyzer.reader = FakeReader()
+    image = Image.new('RGB', (64, 64))
+
+    monkeypatch.setattr(analyzer, "_text_score", lambda embedding: 0.01)
+    assert analyzer._extract_text("photo.jpg", image, [0.1] * 512) == ""
+    assert analyzer.reader.calls == []
+
+    monkeypatch.setattr(analyzer, "_text_score", lambda embedding: 0.9)
+    assert analyzer._extract_text("receipt.jpg", image, [0.1] * 512) == "TOTAL 12.50"
+    assert analyzer.reader.calls == ["receipt.jpg"]
+
+
+def test_chunk_text_overlaps_and_covers_everything():
+    text = " ".join(f"word{i}" for i in range(500))
+    # Blocks split mid-word must not matter
+    blocks = [text[i:i + 77] for i in range(0, len(text), 77)]
+    chunks = list(_chunk_text(blocks, 100, 20))
+    assert all(len(chunk) <= 100 for chunk, _ in chunks)
+    assert chunks[0][1] == 0 and all(new > 0 for _, new in chunks[1:])
+    assert "".join(chunk[new:] for chunk, new in chunks) == text
+
+
+def test_long_text_is_embedded_in_batches(monkeypatch, tmp_path):
+    monkeypatch.setattr(analyzer_module.config, "TEXT_CHUNK_CHARS", 100)
+    monkeypatch.setattr(analyzer_module.config, "TEXT_BATCH_SIZE", 4)
+    path = tmp_path / "notes.txt"
+    path.write_text("alpha " * 200 + "omega " * 2000)
+
+    analyzer = ImageAnalyzer()
+    batches = []
+
+    def fake_encode(content, **kwargs):
+        batches.append(list(content))
+        return np.array([[1.0, 0.0] if "omega" in c else [0.0, 1.0] for c in content])
+
+    monkeypatch.setattr(analyzer, "_encode", fake_encode)
+    result = analyzer.analyze_text(str(path))
+
+    assert max(len(b) for b in batches) <= 4
+    # The pooled vector reflects the whole document, not just its opening
+    assert result["embedding"][0] > result["embedding"][1]
+    assert result["tags"][:2] == ["omega", "alpha"]
+
+
+def _no_blip():
+    raise AssertionError("BLIP must not be loaded on this path")
+
+
+def test_llm_and_text_paths_never_load_blip(monkeypatch, tmp_path):
+    import sys
+    import types
+
+    class FakeModel:
+        def __init__(self, model_id):
+            pass
+
+        def generate_content(self, parts):
+            return types.SimpleNamespace(text='{"caption": "a cat", "tags": ["cat"]}')
+
+    genai = types.SimpleNamespace(configure=lambda api_key: None, GenerativeModel=FakeModel)
+    monkeypatch.setitem(sys.modules, "google.generativeai", genai)
+    monkeypatch.setitem(sys.modules, "google", types.SimpleNamespace(generativeai=genai))
+
+    analyzer = ImageAnalyzer()
+    monkeypatch.setattr(analyzer, "_get_blip", _no_blip)
+    # One vector per image, a batch of vectors per list of text chunks
+    monkeypatch.setattr(analyzer, "_encode",
+                        lambda content, **kwargs: np.ones((len(content), 512)) if isinstance(content, list) else np.ones(512))
+    monkeypatch.setattr(analyzer, "_extract_text", lambda *args: "")
+
+    image_path = tmp_path / "cat.png"
+    Image.new('RGB', (32, 32)).save(image_path)
+    result = analyzer.analyze(str(image_path), use_llm=True, api_key="key")
+    assert result["caption"] == "a cat" and result["tags"] == ["cat"]
+
+    text_path = tmp_path / "notes.txt"
+    text_path.write_text("plain local notes")
+    assert analyzer.analyze(str(text_path))["content"] == "plain local notes"
+
+
+def test_quantize_only_for_int8_on_cpu(monkeypatch):
+    import sys
+    import types
+    calls = []
+    torch = types.SimpleNamespace(
+        nn=types.SimpleNamespace(Linear=object), qint8="qint8",
+        ao=types.SimpleNamespace(quantization=types.SimpleNamespace(
+            quantize_dynamic=lambda model, layers, dtype: calls.append(model) or "quantized")),
+    )
+    monkeypatch.setitem(sys.modules, "torch", torch)
+    analyzer = ImageAnalyzer()
+
+    for mode, device, expected in (("none", "cpu", "model"), ("int8", "cuda", "model"), ("int8", "cpu", "quantized")):
+        monkeypatch.setattr(analyzer_module.config, "QUANTIZE", mode)
+        analyzer._device = device
+        assert analyzer._quantize("model") == expected
+    assert calls == ["model"]
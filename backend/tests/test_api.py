@@ -29,6 +29,11 @@ def test_scan_folder_valid(tmp_path):
     assert response.json()["status"] == "Scan started"
     assert response.json()["path"] == str(test_dir)
 
+    # The scan is persisted as a job with one task per file
+    job_id = response.json()["job_id"]
+    jobs = {j["id"]: j for j in client.get("/jobs").json()["jobs"]}
+    assert jobs[job_id]["total"] == 1
+
 from app.db.storage import db
 import json
 
@@ -48,3 +53,80 @@ def test_get_graph():
     assert response.status_code == 200
     assert "elements" in response.json()
     assert len(response.json()["elements"]) > 0
+
+def test_watch_folder(tmp_path):
+    response = client.post("/watch", json={"path": str(tmp_path), "poll": True})
+    assert response.status_code == 200
+    assert any(w["path"] == str(tmp_path) for w in response.json()["watches"])
+
+    # Watching the same folder twice is rejected
+    response = client.post("/watch", json={"path": str(tmp_path)})
+    assert response.status_code == 409
+
+    response = client.post("/unwatch", json={"path": str(tmp_path)})
+    assert response.status_code == 200
+    assert client.get("/watch").json()["watches"] == []
+
+def test_unwatch_unknown_folder():
+    response = client.post("/unwatch", json={"path": "/not/watched"})
+    assert response.status_code == 404
+
+def test_metrics():
+    client.get("/graph")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert 'imagegraph_stage_seconds_count{stage="graph_serialize"}' in response.text
+    assert "graph_serialize" in client.get("/progress").json()["metrics"]["stages"]
+
+def test_libraries_are_separate(tmp_path, monkeypatch):
+    from app.core.library import libraries
+    monkeypatch.setattr(libraries, "root", str(tmp_path))
+    notes = libraries.get("notes", create=True)
+    lib_id = notes.db.add_image(path="/tmp/lib_note.jpg", type="image", thumbnail_path="", caption="note",
+                                ocr_text="", embedding=[1.0] + [0.0] * 511, tags=["alpha"])
+    default_id = db.add_image(path="/tmp/lib_default.jpg", type="image", thumbnail_path="", caption="default",
+                              ocr_text="", embedding=[0.9, 0.1] + [0.0] * 510, tags=["beta"])
+
+    names = {e["data"].get("name") for e in client.get("/graph", params={"library": "notes"}).json()["elements"]}
+    assert "lib_note.jpg" in names and "lib_default.jpg" not in names
+    assert any(l["name"] == "notes" for l in client.get("/libraries").json()["libraries"])
+    assert client.get("/graph", params={"library": "missing"}).status_code == 404
+    assert client.get("/graph", params={"library": "../etc"}).status_code == 400
+    # Stray files in the library folder are not libraries
+    (tmp_path / "my lib.sqlite").touch()
+    assert "my lib" not in libraries.names()
+
+    # Similarity queries can reach across libraries through their vector indexes
+    results = client.get(f"/similar/{default_id}", params={"across": "*", "k": 50}).json()["results"]
+    assert {"library": "notes", "id": lib_id} in [{"library": r["library"], "id": r["id"]} for r in results]
+    assert default_id not in [r["id"] for r in results if r["library"] == "default"]
+
+def test_import_does_not_load_ml_stack():
+    import subprocess
+    import sys
+    code = "import sys, app.main; print(sorted(m for m in ('torch', 'transformers', 'sentence_transformers', 'easyocr', 'openai') if m in sys.modules))"
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                         cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    assert out.stdout.strip() == "[]", out.stderr
+
+def test_viewer_mode_rejects_scans(tmp_path, monkeypatch):
+    from app.core import config
+    monkeypatch.setattr(config, "MODE", "viewer")
+    assert client.post("/scan", json={"path": str(tmp_path)}).status_code == 403
+    assert client.post("/watch", json={"path": str(tmp_path)}).status_code == 403
+    assert client.get("/graph").status_code == 200
+
+def test_api_key_is_not_persisted_and_reset_keeps_jobs(tmp_path, monkeypatch):
+    from app.core.worker import worker
+    (tmp_path / "a.jpg").touch()
+    monkeypatch.setattr(worker, "ensure_running", lambda added=0: False)
+    job_id = worker.start_scan(str(tmp_path), use_llm=True, api_key="secret-key")
+
+    options = db.conn.execute("SELECT options FROM scan_jobs WHERE id = ?", (job_id,)).fetchone()[0]
+    assert "secret-key" not in options
+    assert worker._api_keys[job_id] == "secret-key"
+
+    # Resetting items leaves the job queue (shared by every library) alone
+    db.clear_database()
+    assert job_id in [j["id"] for j in db.get_jobs()]
+    db.set_jobs_status(('pending',), 'cancelled', job_id)
@@ -0,0 +1,186 @@
+import json
+from app.core.graph import GraphBuilder
+from app.db.storage import Storage
+
+
+def _normalize(element):
+    data = dict(element["data"])
+    # Endpoint order and float noise depend on how the graph was built
+    if "source" in data:
+        data["source"], data["target"] = sorted((data["source"], data["target"]))
+    if isinstance(data.get("weight"), float):
+        data["weight"] = round(data["weight"], 5)
+    return json.dumps(data, sort_keys=True)
+
+
+def _elements(builder):
+    return {_normalize(e) for e in builder.export_cytoscape()}
+
+
+def _add(db, path, embedding, tags):
+    return db.add_image(path=path, type="image", thumbnail_path="", caption=path,
+                        ocr_text="", embedding=embedding, tags=tags)
+
+
+def test_incremental_updates_match_full_rebuild(tmp_path):
+    db = Storage(str(tmp_path / "graph.sqlite"))
+    builder = GraphBuilder(sim_threshold=0.9, storage=db)
+    a = _add(db, "/tmp/inc_a.jpg", [1.0] + [0.0] * 511, ["cat", "pet"])
+    builder.build_graph()
+
+    # Adding an item patches the cached graph
+    b = _add(db, "/tmp/inc_b.jpg", [0.99, 0.1] + [0.0] * 510, ["cat", "sofa"])
+    builder.update_items([b])
+    patched = _elements(builder)
+    builder.invalidate_cache()
+    assert patched == _elements(builder)
+
+    # Removing one drops its node, edges and orphaned concepts
+    db.delete_image_by_path("/tmp/inc_a.jpg")
+    builder.remove_items([a])
+    patched = _elements(builder)
+    assert not any('"con_pet"' in e for e in patched)
+    builder.invalidate_cache()
+    assert patched == _elements(builder)
+
+
+def test_layout_and_collapsed_clusters(tmp_path, monkeypatch):
+    from app.core import config
+    db = Storage(str(tmp_path / "graph.sqlite"))
+    builder = GraphBuilder(sim_threshold=0.9, storage=db)
+    for i in range(6):
+        _add(db, f"/tmp/lay_cat_{i}.jpg", [1.0, 0.01 * i] + [0.0] * 510, ["cat", "pet"])
+        _add(db, f"/tmp/lay_car_{i}.jpg", [0.0, 0.01 * i, 1.0] + [0.0] * 509, ["car", "road"])
+
+    elements = builder.export_cytoscape(with_layout=True)
+    nodes = [e for e in elements if "source" not in e["data"]]
+    assert all("position" in e and e["data"]["community"] is not None for e in nodes)
+    # Cached until the graph changes
+    assert builder.get_layout().positions is builder.get_layout().positions
+
+    monkeypatch.setattr(config, "CLUSTER_MIN_SIZE", 2)
+    collapsed = builder.export_cytoscape(collapse=True)
+    ids = {e["data"]["id"] for e in collapsed}
+    clusters = [e for e in collapsed if e["data"].get("type") == "cluster"]
+    assert len(clusters) >= 2
+    loose = [e for e in collapsed if e["data"].get("type") == "image"]
+    assert sum(c["data"]["items"] for c in clusters) + len(loose) == 12
+    # Every edge must point at a node that is still in the collapsed view
+    assert all(e["data"]["source"] in ids and e["data"]["target"] in ids
+               for e in collapsed if "source" in e["data"])
+
+    # Expanding a community brings its members back
+    expand = {clusters[0]["data"]["community"]}
+    expanded = builder.export_cytoscape(collapse=True, expand=expand)
+    assert clusters[0]["data"]["id"] not in {e["data"]["id"] for e in expanded}
+
+
+def test_compact_vectors_keep_the_same_edges(monkeypatch, tmp_path):
+    import numpy as np
+    from app.core import config
+    from app.core.vectors import decode, encode
+
+    vector = np.linspace(-1, 1, 512)
+    for fmt in ("float16", "int8"):
+        blob, scale = encode(vector, fmt)
+        restored = decode(blob, fmt, scale)
+        assert restored @ vector / np.linalg.norm(restored) / np.linalg.norm(vector) > 0.999
+
+    rng = np.random.default_rng(0)
+    centres = rng.normal(size=(4, 512))
+    embeddings = [centres[i % 4] + rng.normal(scale=0.4, size=512) for i in range(40)]
+
+    def edges(fmt, index_fmt, dim):
+        monkeypatch.setattr(config, "VECTOR_INDEX_FORMAT", index_fmt)
+        monkeypatch.setattr(config, "VECTOR_DIM", dim)
+        storage = Storage(str(tmp_path / f"{fmt}_{index_fmt}_{dim}.sqlite"), vector_format=fmt)
+        for i, emb in enumerate(embeddings):
+            storage.add_image(path=f"/tmp/cv_{i}.jpg", type="image", thumbnail_path="", caption="",
+                              ocr_text="", embedding=emb, tags=[])
+        G = GraphBuilder(sim_threshold=0.7, storage=storage).build_graph()
+        return {tuple(sorted((u, v))) for u, v, d in G.edges(data=True) if d["type"] == "similar"}
+
+    expected = edges("float32", "float32", 0)
+    assert expected
+    # Coarse or reduced in-memory vectors are re-ranked against the stored float32 vectors
+    assert edges("float32", "int8", 0) == expected
+    assert edges("float32", "float32", 16) == expected
+    # Clusters are well clear of the threshold, so int8 storage loses no edges either
+    assert edges("int8", "int8", 0) == expected
+
+
+def test_graph_and_search_share_one_index(tmp_path):
+    from app.core.library import Library
+    db = Storage(str(tmp_path / "graph.sqlite"))
+    builder = GraphBuilder(sim_threshold=0.9, storage=db)
+    assert Library("shared", db, builder).index is builder.index
+
+    _add(db, "/tmp/idx_a.jpg", [1.0] + [0.0] * 511, ["cat"])
+    builder.build_graph()
+    vectors = builder.index.vectors()
+
+    b = _add(db, "/tmp/idx_b.jpg", [0.0, 1.0] + [0.0] * 510, ["car"])
+    builder.update_items([b])
+    # Patched in place rather than reloaded from storage
+    assert builder.index.vectors() is vectors and len(vectors) == 2
+    assert builder.index.search([0.1, 1.0] + [0.0] * 510, k=1)[0][0] == b
+
+    db.delete_image_by_path("/tmp/idx_b.jpg")
+    builder.remove_items([b])
+    assert builder.index.vectors() is vectors and len(vectors) == 1
+
+
+def test_snapshot_version_matches_elements(tmp_path):
+    db = Storage(str(tmp_path / "graph.sqlite"))
+    builder = GraphBuilder(sim_threshold=0.9, storage=db)
+    _add(db, "/tmp/snap_a.jpg", [1.0] + [0.0] * 511, ["cat"])
+    elements, version = builder.export_snapshot()
+    assert version == builder.version and any(e["data"]["id"].startswith("img_") for e in elements)
+
+    b = _add(db, "/tmp/snap_b.jpg", [0.0, 1.0] + [0.0] * 510, ["car"])
+    builder.update_items([b])
+    elements, newer = builder.export_snapshot()
+    assert newer > version and f"img_{b}" in {e["data"]["id"] for e in elements}
+
+
+def test_incremental_placements_trigger_a_full_layout(tmp_path, monkeypatch):
+    from app.core import config
+    monkeypatch.setattr(config, "LAYOUT_REFRESH", 0.5)
+    db = Storage(str(tmp_path / "graph.sqlite"))
+    builder = GraphBuilder(sim_threshold=0.9, storage=db)
+    for i in range(4):
+        _add(db, f"/tmp/refresh_base_{i}.jpg", [1.0, 0.01 * i] + [0.0] * 510, ["cat"])
+    layout = builder.get_layout()
+    base = layout._full_size
+
+    # Scan deltas place new items next to their neighbours as they are published
+    for i in range(6):
+        builder.update_items([_add(db, f"/tmp/refresh_new_{i}.jpg", [0.0, 1.0, 0.01 * i] + [0.0] * 509, ["car"])])
+    assert layout._placed > config.LAYOUT_REFRESH * base
+
+    builder.get_layout()
+    assert layout._placed == 0
+    assert layout._full_size == len(builder.build_graph())
+
+
+def test_index_reloads_after_writes_it_did_not_see(tmp_path):
+    db = Storage(str(tmp_path / "graph.sqlite"))
+    builder = GraphBuilder(sim_threshold=0.9, storage=db)
+    cat = [1.0] + [0.0] * 511
+    _add(db, "/tmp/rev_a.jpg", cat, ["cat"])
+    builder.build_graph()
+
+    # A search reloads the index between a scan's write and its graph patch
+    b = _add(db, "/tmp/rev_b.jpg", cat, ["cat"])
+    assert b in [iid for iid, _ in builder.index.search(cat, k=5)]
+    builder.update_items([b])
+
+    # Writes that bypass the graph must still reach the index afterwards
+    db.clear_database()
+    assert builder.index.search(cat, k=5) == []
+    builder.set_sim_threshold(0.8)
+    c = _add(db, "/tmp/rev_c.jpg", cat, ["cat"])
+    builder.update_items([c])  # Cache is invalid, so only a resync is published
+    d = _add(db, "/tmp/rev_d.jpg", cat, ["cat"])
+    G = builder.build_graph()
+    assert G.has_edge(f"img_{c}", f"img_{d}")
@@ -0,0 +1,83 @@
+import os
+import time
+import app.core.worker as worker_module
+from app.core.library import libraries
+from app.core.watcher import FolderWatcher
+
+
+class StubAnalyzer:
+    def analyze(self, file_path, *args, **kwargs):
+        with open(file_path) as f:
+            text = f.read()
+        return {"caption": "", "content": text, "embedding": [float(len(text))] + [1.0] * 511,
+                "tags": text.split(), "metadata": {"method": "Stub", "duration": 0.0}}
+
+
+def _wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "watcher did not catch up"
+        time.sleep(0.05)
+
+
+def test_polling_reconcile_patches_graph(tmp_path, monkeypatch):
+    monkeypatch.setattr(libraries, "root", str(tmp_path / "libraries"))
+    monkeypatch.setattr(worker_module, "analyzer", StubAnalyzer())
+    library = libraries.get("watch_test", create=True)
+    calls = []
+    monkeypatch.setattr(library.graph, "update_items", lambda ids: calls.append(("update", list(ids))))
+    monkeypatch.setattr(library.graph, "remove_items", lambda ids: calls.append(("remove", list(ids))))
+
+    folder = tmp_path / "watched"
+    folder.mkdir()
+    note = folder / "note.txt"
+    note.write_text("alpha beta")
+
+    watcher = FolderWatcher(debounce=0.1, poll_interval=0.1)
+    watcher.watch(str(folder), poll=True, library="watch_test")
+    try:
+        # Created
+        _wait_for(lambda: len(calls) == 1)
+        assert calls[0][0] == "update"
+        item_id = calls[0][1][0]
+
+        # Modified: re-analyzed in place under the same ID
+        # (written aside and moved in, so polling sees exactly one new mtime)
+        edited = tmp_path / "edited.txt"
+        edited.write_text("alpha beta gamma")
+        mtime = os.path.getmtime(note) + 10
+        os.utime(edited, (mtime, mtime))
+        os.replace(edited, note)
+        _wait_for(lambda: len(calls) == 2)
+        assert calls[1] == ("update", [item_id])
+        assert "gamma" in library.db.get_image_by_id(item_id)[3]
+
+        # Deleted
+        note.unlink()
+        _wait_for(lambda: len(calls) == 3)
+        assert calls[2] == ("remove", [item_id])
+        assert library.db.get_mtime(str(note)) is None
+    finally:
+        watcher.unwatch(str(folder))
+
+
+def test_dispatcher_survives_a_failing_batch(monkeypatch):
+    watcher = FolderWatcher(debounce=0.0)
+    applied = []
+
+    def apply(paths):
+        if not applied:
+            applied.append(None)
+            raise RuntimeError("disk went away")
+        applied.extend(paths)
+
+    monkeypatch.setattr(watcher, "_apply", apply)
+    logged = []
+    monkeypatch.setattr(worker_module.worker, "log", logged.append)
+    watcher._ensure_dispatcher()
+
+    watcher.notify("/tmp/first.jpg")
+    _wait_for(lambda: applied)
+    watcher.notify("/tmp/second.jpg")
+    _wait_for(lambda: "/tmp/second.jpg" in applied)
+    assert any("disk went away" in line for line in logged)
@@ -0,0 +1,169 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import app.core.inference as inference_module
+import app.core.worker as worker_module
+from app.core.inference import InferencePool
+from app.core.library import libraries
+from app.core.worker import ScanWorker
+from app.db.storage import db
+
+
+class StubAnalyzer:
+    def __init__(self):
+        self.rng = np.random.default_rng(0)
+
+    def analyze(self, file_path, *args, **kwargs):
+        return {"caption": "stub", "content": "", "embedding": self.rng.normal(size=512).tolist(),
+                "tags": ["stub"], "metadata": {"method": "Stub", "duration": 0.0}}
+
+
+def _wait_idle(worker, timeout=30):
+    deadline = time.monotonic() + timeout
+    while worker.status == "scanning":
+        assert time.monotonic() < deadline, "scan did not finish"
+        time.sleep(0.05)
+
+
+def test_multi_thread_scan_finishes_every_task_once(tmp_path, monkeypatch):
+    # The app's own worker shares the queue; let it drain so it cannot claim these tasks
+    _wait_idle(worker_module.worker)
+    monkeypatch.setattr(libraries, "root", str(tmp_path / "libraries"))
+    pool = InferencePool(3)
+    monkeypatch.setattr(pool, "analyze", StubAnalyzer().analyze)
+    monkeypatch.setattr(worker_module, "inference_pool", pool)
+
+    folder = tmp_path / "scan"
+    folder.mkdir()
+    for i in range(30):
+        (folder / f"note_{i}.txt").write_text(f"note {i}")
+
+    worker = ScanWorker()
+    finished = []
+    finish = worker._finish
+    monkeypatch.setattr(worker, "_finish", lambda: finished.append(1) or finish())
+    job_id = worker.start_scan(str(folder), library="scan_test")
+    assert len(worker.threads) == 3
+
+    _wait_idle(worker)
+    for t in worker.threads:
+        t.join(5)
+
+    job = next(j for j in db.get_jobs() if j["id"] == job_id)
+    assert job["status"] == "done"
+    assert (job["total"], job["done"]) == (30, 30)
+    assert finished == [1]
+    assert libraries.get("scan_test").db.count_images() == 30
+
+
+def test_inference_pool_round_trips_embedding(monkeypatch):
+    embedding = np.linspace(-1, 1, 512, dtype=np.float32)
+
+    class Analyzer:
+        def analyze(self, file_path, *args):
+            return {"caption": file_path, "embedding": embedding.tolist(), "metadata": {}}
+
+    monkeypatch.setattr(inference_module, "_process_analyzer", Analyzer())
+    pool = InferencePool(1)
+    # Threads instead of spawned processes, so the test needs no models; results still go through bytes
+    pool._pool = ThreadPoolExecutor(1)
+    try:
+        result = pool.analyze("/tmp/a.jpg")
+    finally:
+        pool.shutdown()
+    assert result["caption"] == "/tmp/a.jpg"
+    assert result["embedding"].dtype == np.float32
+    np.testing.assert_array_equal(result["embedding"], embedding)
+
+
+def test_profiling_never_fails_a_task(monkeypatch):
+    worker = ScanWorker()
+    profiler = worker._start_profiler()
+    assert profiler is not None
+    # Only one thread profiles at a time; the others run their tasks unprofiled
+    assert worker._start_profiler() is None
+    worker._stop_profiler(1, profiler)
+    assert 1 in worker._profiles
+
+    class BusyProfile:
+        def enable(self):
+            raise ValueError("Another profiling tool is already active")
+
+    monkeypatch.setattr(worker_module.cProfile, "Profile", BusyProfile)
+    assert worker._start_profiler() is None
+    assert not worker._profile_lock.locked()
+
+
+def _task(storage, path):
+    return storage.conn.execute(
+        "SELECT status, attempts FROM scan_tasks WHERE path = ?", (path,)
+    ).fetchone()
+
+
+def _job_status(storage, job_id):
+    return storage.conn.execute("SELECT status FROM scan_jobs WHERE id = ?", (job_id,)).fetchone()[0]
+
+
+def test_queue_priority_retry_and_requeue(tmp_path):
+    from app.db.storage import MAX_TASK_ATTEMPTS, Storage
+    storage = Storage(str(tmp_path / "queue.sqlite"))
+    low = storage.create_job("/low", ["/low/1", "/low/2"], {})
+    high = storage.create_job("/high", ["/high/1"], {}, priority=5)
+
+    # Higher priority first, then older jobs
+    assert [storage.claim_next_task()[2] for _ in range(3)] == ["/high/1", "/low/1", "/low/2"]
+
+    # A task that keeps failing ends up failed and can be retried with a fresh budget
+    task_id = storage.conn.execute("SELECT id FROM scan_tasks WHERE path = '/high/1'").fetchone()[0]
+    for attempt in range(MAX_TASK_ATTEMPTS):
+        assert storage.fail_task(task_id, "boom") == (attempt == MAX_TASK_ATTEMPTS - 1)
+    assert storage.finish_job_if_complete(high) == "failed"
+    assert storage.retry_failed_tasks(high) == 1
+    assert _task(storage, "/high/1") == ("pending", 0)
+    assert _job_status(storage, high) == "pending"
+
+    # Tasks left in_progress by a crash go back to the queue, counting the attempt
+    assert storage.requeue_interrupted_tasks() == 2
+    assert _task(storage, "/low/1") == ("pending", 1)
+    assert _job_status(storage, low) == "in_progress"
+
+
+def test_startup_keeps_paused_jobs_paused(tmp_path, monkeypatch):
+    from app.db.storage import Storage
+    storage = Storage(str(tmp_path / "queue.sqlite"))
+    monkeypatch.setattr(worker_module, "db", storage)
+    worker = ScanWorker()
+    monkeypatch.setattr(worker, "ensure_running", lambda added=0: False)
+
+    paused = storage.create_job("/paused", ["/paused/1"], {})
+    storage.set_jobs_status(('pending',), 'paused', paused)
+    # Crashed right after its last file was marked done
+    finished = storage.create_job("/finished", ["/finished/1"], {})
+    storage.complete_task(storage.claim_next_task()[0])
+    assert _job_status(storage, finished) == "in_progress"
+
+    worker.recover()
+    assert _job_status(storage, paused) == "paused"
+    assert _job_status(storage, finished) == "done"
+
+    worker.resume()
+    assert _job_status(storage, paused) == "pending"
+
+
+def test_resume_while_scanning_leaves_running_tasks_alone(tmp_path, monkeypatch):
+    from app.db.storage import Storage
+    storage = Storage(str(tmp_path / "queue.sqlite"))
+    monkeypatch.setattr(worker_module, "db", storage)
+    worker = ScanWorker()
+    monkeypatch.setattr(worker, "ensure_running", lambda added=0: True)
+
+    storage.create_job("/busy", ["/busy/1", "/busy/2"], {})
+    storage.claim_next_task()
+    worker.status = "scanning"
+    worker.resume()
+    assert _task(storage, "/busy/1") == ("in_progress", 0)
+
+    # With no scan thread alive the same task was interrupted and is re-queued
+    worker.status = "idle"
+    worker.recover()
+    assert _task(storage, "/busy/1") == ("pending", 1)
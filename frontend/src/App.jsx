@@ -1,4 +1,4 @@
-import React, { useState, useEffect, useCallback } from 'react';
+import React, { useState, useEffect, useCallback, useRef } from 'react';
 import GraphView from './components/GraphView';
 import ControlPanel from './components/ControlPanel';
 import { ToastProvider } from './components/Toast';
@@ -19,30 +19,140 @@ function App() {
   const [selectedNode, setSelectedNode] = useState(null);
   const [simThreshold, setSimThreshold] = useState(0.7);
   const [searchQuery, setSearchQuery] = useState("");
+  const [events, setEvents] = useState(null);
+  const [collapsed, setCollapsed] = useState(false);
+  const [library, setLibrary] = useState(localStorage.getItem('ig_library') || 'default');
+  const libraryRef = useRef(library);
+  const graphVersion = useRef(0);
+  const thresholdRef = useRef(0.7);
+  const collapsedRef = useRef(false);
+  // Communities the user expanded while clusters are collapsed
+  const expandedRef = useRef(new Set());
+  // Deltas that arrive while /graph is loading are replayed on top of its snapshot
+  const fetchSeq = useRef(0);
+  const fetchingRef = useRef(false);
+  const bufferedDeltas = useRef([]);
 
-  const fetchGraph = async (threshold = 0.7) => {
+  const fetchGraph = async (threshold = thresholdRef.current) => {
+    const seq = ++fetchSeq.current;
+    fetchingRef.current = true;
     try {
-      const res = await fetch(`${API_Base}/graph?sim_threshold=${threshold}`);
+      // Positions and communities are computed (and cached) by the backend
+      const params = new URLSearchParams({
+        sim_threshold: threshold,
+        layout: true,
+        collapse: collapsedRef.current,
+        expand: Array.from(expandedRef.current).join(','),
+        library: libraryRef.current,
+      });
+      const res = await fetch(`${API_Base}/graph?${params}`);
+      // A newer fetch (threshold, collapse or library change) supersedes this one
+      if (seq !== fetchSeq.current) return;
+      if (!res.ok) {
+        // A library that has not been scanned into yet
+        graphVersion.current = 0;
+        setElements([]);
+        return;
+      }
       const data = await res.json();
+      if (seq !== fetchSeq.current) return;
+      graphVersion.current = data.version || 0;
       setElements(data.elements);
     } catch (e) {
       console.error("Failed to fetch graph", e);
+    } finally {
+      if (seq === fetchSeq.current) {
+        fetchingRef.current = false;
+        const buffered = bufferedDeltas.current;
+        bufferedDeltas.current = [];
+        buffered.forEach(handleDelta);
+      }
     }
   };
 
+  const debouncedResync = useRef(debounce(() => fetchGraph(), 500)).current;
+
+  const handleDelta = (delta) => {
+    // Every library has its own graph
+    if (delta.library !== libraryRef.current) return;
+    if (fetchingRef.current) {
+      bufferedDeltas.current.push(delta);
+      return;
+    }
+    // Deltas older than the graph we fetched are already included in it
+    if (delta.version <= graphVersion.current) return;
+    // Deltas refer to individual nodes, so a collapsed view is refetched instead
+    if (collapsedRef.current) {
+      debouncedResync();
+      return;
+    }
+    graphVersion.current = delta.version;
+    const removed = new Set(delta.remove);
+    setElements(prev => {
+      const byId = new Map(prev.map(el => [el.data.id, el]));
+      removed.forEach(id => byId.delete(id));
+      delta.upsert.forEach(el => byId.set(el.data.id, el));
+      return Array.from(byId.values());
+    });
+  };
+
   // Initial fetch
   useEffect(() => {
     fetchGraph();
   }, []);
 
+  // Server-pushed progress and graph deltas
+  useEffect(() => {
+    const source = new EventSource(`${API_Base}/events`);
+
+    source.addEventListener('graph', (e) => handleDelta(JSON.parse(e.data)));
+    source.addEventListener('resync', (e) => {
+      const data = JSON.parse(e.data || '{}');
+      if (!data.library || data.library === libraryRef.current) debouncedResync();
+    });
+
+    setEvents(source);
+    return () => source.close();
+  }, []);
+
   // Debounced fetch for slider changes
   const debouncedFetchGraph = useCallback(
     debounce((threshold) => fetchGraph(threshold), 300),
     []
   );
 
+  // Debounced so typing a library name does not fetch every prefix
+  const debouncedLibraryFetch = useCallback(debounce(() => fetchGraph(), 400), []);
+
+  const handleLibraryChange = (name) => {
+    const value = name.trim();
+    setLibrary(name);
+    libraryRef.current = value || 'default';
+    localStorage.setItem('ig_library', libraryRef.current);
+    expandedRef.current = new Set();
+    setSelectedNode(null);
+    debouncedLibraryFetch();
+  };
+
+  const handleToggleCollapse = () => {
+    collapsedRef.current = !collapsedRef.current;
+    expandedRef.current = new Set();
+    setCollapsed(collapsedRef.current);
+    fetchGraph();
+  };
+
+  const handleNodeClick = (data) => {
+    if (data && data.type === 'cluster') {
+      expandedRef.current.add(data.community);
+      fetchGraph();
+      return;
+    }
+    setSelectedNode(data);
+  };
+
   const handleUpdateParams = (threshold) => {
     setSimThreshold(threshold);
+    thresholdRef.current = threshold;
     debouncedFetchGraph(threshold);
   }
 
@@ -83,13 +193,19 @@ function App() {
             onUpdateParams={handleUpdateParams}
             selectedNode={selectedNode}
             onSearch={setSearchQuery}
+            events={events}
+            library={library}
+            onLibraryChange={handleLibraryChange}
           />
         </div>
         <div style={{ flex: 1, position: 'relative' }}>
           <GraphView
             elements={elements}
-            onNodeClick={setSelectedNode}
+            onNodeClick={handleNodeClick}
             searchQuery={searchQuery}
+            collapsed={collapsed}
+            onToggleCollapse={handleToggleCollapse}
+            library={libraryRef.current}
           />
         </div>
       </div>
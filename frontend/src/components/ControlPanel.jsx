@@ -4,7 +4,7 @@ import { useToast } from './Toast';
 
 const API_Base = "http://localhost:8001";
 
-const ControlPanel = ({ onScan, onUpdateParams, onSelectImage, selectedNode, onSearch }) => {
+const ControlPanel = ({ onScan, onUpdateParams, onSelectImage, selectedNode, onSearch, events, library, onLibraryChange }) => {
     const toast = useToast();
     const [path, setPath] = useState("");
     const [status, setStatus] = useState("idle");
@@ -21,6 +21,19 @@ const ControlPanel = ({ onScan, onUpdateParams, onSelectImage, selectedNode, onS
     const [baseUrl, setBaseUrl] = useState("http://localhost:1234/v1");
     const [models, setModels] = useState([]);
     const [selectedModel, setSelectedModel] = useState("gemini-1.5-flash-latest");
+    const [libraryNames, setLibraryNames] = useState([]);
+    const libraryName = library.trim() || 'default';
+
+    const fetchLibraries = () => {
+        fetch(`${API_Base}/libraries`)
+            .then(res => res.json())
+            .then(data => setLibraryNames(data.libraries.map(l => l.name)))
+            .catch(e => console.error(e));
+    };
+
+    useEffect(() => {
+        fetchLibraries();
+    }, []);
 
     // Load settings from localStorage on mount
     useEffect(() => {
@@ -247,46 +260,30 @@ const ControlPanel = ({ onScan, onUpdateParams, onSelectImage, selectedNode, onS
         if (useLlm) fetchModels();
     }, [apiKey, useLlm, provider, baseUrl]);
 
+    // Progress and log lines are pushed over the /events stream instead of polled
     useEffect(() => {
-        const checkStatus = async () => {
-            try {
-                const res = await fetch(`${API_Base}/progress`);
-                const data = await res.json();
-                if (data.status === "scanning") {
-                    setStatus("scanning");
-                    setProgress(data);
-                }
-            } catch (e) {
-                console.error("Failed to check status", e);
-            }
-        }
-        checkStatus();
-    }, []);
-
-    useEffect(() => {
-        let interval;
-        if (status === "scanning") {
-            interval = setInterval(async () => {
-                try {
-                    const res = await fetch(`${API_Base}/progress`);
-                    const data = await res.json();
-                    setProgress(data);
-                    if (data.status === "idle" && data.total > 0 && data.processed === data.total) {
-                        setStatus("idle");
-                        onScan();
-                    }
-                } catch (e) {
-                    console.error(e);
-                }
-            }, 1000);
-        }
-        return () => clearInterval(interval);
-    }, [status, onScan]);
+        if (!events) return;
+        const handleProgress = (e) => {
+            const data = JSON.parse(e.data);
+            setProgress(prev => ({ ...prev, ...data }));
+            setStatus(data.status);
+        };
+        const handleLog = (e) => {
+            const { line } = JSON.parse(e.data);
+            setProgress(prev => ({ ...prev, logs: [...(prev.logs || []), line].slice(-50) }));
+        };
+        events.addEventListener('progress', handleProgress);
+        events.addEventListener('log', handleLog);
+        return () => {
+            events.removeEventListener('progress', handleProgress);
+            events.removeEventListener('log', handleLog);
+        };
+    }, [events]);
 
     useEffect(() => {
         if (selectedNode && (selectedNode.type === 'image' || selectedNode.type === 'text')) {
             const id = selectedNode.id.split('_')[1];
-            fetch(`${API_Base}/image/${id}`)
+            fetch(`${API_Base}/image/${id}?library=${encodeURIComponent(libraryName)}`)
                 .then(res => res.json())
                 .then(data => setImageMetadata(data))
                 .catch(e => console.error(e));
@@ -307,11 +304,13 @@ const ControlPanel = ({ onScan, onUpdateParams, onSelectImage, selectedNode, onS
                     api_key: apiKey,
                     model_id: selectedModel,
                     provider: provider,
-                    base_url: baseUrl
+                    base_url: baseUrl,
+                    library: libraryName
                 })
             });
             if (res.ok) {
                 setStatus("scanning");
+                fetchLibraries();
                 toast.success("Scan started successfully");
             } else {
                 toast.error("Scan failed to start (Check API Key if LLM enabled)");
@@ -322,9 +321,9 @@ const ControlPanel = ({ onScan, onUpdateParams, onSelectImage, selectedNode, onS
     };
 
     const handleReset = async () => {
-        if (!window.confirm("Are you sure you want to clear the entire database? This cannot be undone.")) return;
+        if (!window.confirm(`Are you sure you want to clear the "${libraryName}" library? This cannot be undone.`)) return;
         try {
-            const res = await fetch(`${API_Base}/reset`, { method: 'POST' });
+            const res = await fetch(`${API_Base}/reset?library=${encodeURIComponent(libraryName)}`, { method: 'POST' });
             if (res.ok) {
                 toast.success("Database cleared successfully");
                 onScan();
@@ -393,6 +392,19 @@ const ControlPanel = ({ onScan, onUpdateParams, onSelectImage, selectedNode, onS
 
             {/* Scan Section */}
             <div style={styles.card}>
+                <label style={styles.label}>Library</label>
+                <input
+                    type="text"
+                    list="ig-libraries"
+                    value={library}
+                    onChange={(e) => onLibraryChange(e.target.value)}
+                    placeholder="default"
+                    style={{ ...styles.input, marginBottom: '12px' }}
+                />
+                <datalist id="ig-libraries">
+                    {libraryNames.map(name => <option key={name} value={name} />)}
+                </datalist>
+
                 <label style={styles.label}>Scan Folder</label>
                 <div style={{ display: 'flex', gap: '8px' }}>
                     <input
@@ -561,7 +573,7 @@ const ControlPanel = ({ onScan, onUpdateParams, onSelectImage, selectedNode, onS
                             <div>
                                 {selectedNode.type === 'image' ? (
                                     <img
-                                        src={`${API_Base}/image_content/${imageMetadata.id}`}
+                                        src={`${API_Base}/image_content/${imageMetadata.id}?library=${encodeURIComponent(libraryName)}`}
                                         alt="preview"
                                         style={{ width: '100%', borderRadius: 'var(--radius-md)', marginBottom: '12px' }}
                                     />
@@ -1,12 +1,14 @@
 import React, { useEffect, useRef, useState } from 'react';
 import CytoscapeComponent from 'react-cytoscapejs';
-import { ZoomIn, ZoomOut, Maximize2, Grid3X3 } from 'lucide-react';
+import { ZoomIn, ZoomOut, Maximize2, Grid3X3, Layers } from 'lucide-react';
 
 const API_Base = "http://localhost:8001";
 
-const GraphView = ({ elements, onNodeClick, searchQuery }) => {
+const GraphView = ({ elements, onNodeClick, searchQuery, collapsed, onToggleCollapse, library }) => {
     const cyRef = useRef(null);
-    const [layout, setLayout] = useState('cose');
+    // "preset" uses the positions computed by the backend
+    const [layout, setLayout] = useState('preset');
+    const fittedRef = useRef(false);
 
     const style = [
         {
@@ -36,7 +38,7 @@ const GraphView = ({ elements, onNodeClick, searchQuery }) => {
                 'shape': 'round-rectangle',
                 'width': 64,
                 'height': 64,
-                'background-image': (node) => `${API_Base}/thumbnail/${node.data('id').split('_')[1]}`,
+                'background-image': (node) => `${API_Base}/thumbnail/${node.data('id').split('_')[1]}?library=${encodeURIComponent(library)}`,
                 'background-fit': 'cover',
                 'border-width': 2,
                 'border-color': 'rgba(255, 255, 255, 0.2)'
@@ -61,6 +63,26 @@ const GraphView = ({ elements, onNodeClick, searchQuery }) => {
                 'font-size': '9px'
             }
         },
+        {
+            selector: 'node[type="cluster"]',
+            style: {
+                'background-color': '#8b5cf6',
+                'shape': 'ellipse',
+                'width': 'mapData(size, 1, 500, 40, 160)',
+                'height': 'mapData(size, 1, 500, 40, 160)',
+                'label': (node) => `${node.data('name')} (${node.data('items')})`,
+                'font-size': '12px',
+                'border-width': 2,
+                'border-color': 'rgba(255, 255, 255, 0.3)'
+            }
+        },
+        {
+            selector: 'edge[type="cluster_link"]',
+            style: {
+                'line-color': 'rgba(139, 92, 246, 0.35)',
+                'width': 'mapData(weight, 1, 100, 1, 8)'
+            }
+        },
         {
             selector: 'node:active',
             style: {
@@ -141,6 +163,12 @@ const GraphView = ({ elements, onNodeClick, searchQuery }) => {
         if (!cyRef.current) return;
 
         const layouts = {
+            preset: {
+                name: 'preset',
+                // Only fit the first time so graph deltas don't move the viewport
+                fit: !fittedRef.current,
+                padding: 50,
+            },
             cose: {
                 name: 'cose',
                 animate: true,
@@ -170,12 +198,18 @@ const GraphView = ({ elements, onNodeClick, searchQuery }) => {
         };
 
         cyRef.current.layout(layouts[name] || layouts.cose).run();
+        fittedRef.current = true;
     };
 
     useEffect(() => {
-        if (cyRef.current) {
-            runLayout(layout);
-        }
+        fittedRef.current = false;
+    }, [layout, collapsed]);
+
+    useEffect(() => {
+        if (!cyRef.current) return;
+        // Graph deltas can arrive many times per second during a scan; lay out once they settle
+        const timer = setTimeout(() => runLayout(layout), 300);
+        return () => clearTimeout(timer);
     }, [elements, layout]);
 
     useEffect(() => {
@@ -344,11 +378,21 @@ const GraphView = ({ elements, onNodeClick, searchQuery }) => {
                     <Maximize2 size={18} />
                 </button>
 
+                <button
+                    style={{ ...btnStyle, color: collapsed ? 'var(--text-primary)' : btnStyle.color }}
+                    onClick={onToggleCollapse}
+                    onMouseOver={(e) => { e.currentTarget.style.background = 'var(--bg-elevated)'; e.currentTarget.style.color = 'var(--text-primary)'; }}
+                    onMouseOut={(e) => { e.currentTarget.style.background = 'var(--bg-surface)'; e.currentTarget.style.color = collapsed ? 'var(--text-primary)' : 'var(--text-secondary)'; }}
+                    title={collapsed ? "Expand clusters" : "Collapse clusters"}
+                >
+                    <Layers size={18} />
+                </button>
+
                 <div style={{ position: 'relative' }}>
                     <button
                         style={btnStyle}
                         onClick={() => {
-                            const layouts = ['cose', 'circle', 'grid', 'concentric'];
+                            const layouts = ['preset', 'cose', 'circle', 'grid', 'concentric'];
                             const nextIdx = (layouts.indexOf(layout) + 1) % layouts.length;
                             setLayout(layouts[nextIdx]);
                         }}
@@ -387,10 +431,14 @@ const GraphView = ({ elements, onNodeClick, searchQuery }) => {
                     <div style={{ width: 14, height: 14, background: '#f59e0b', borderRadius: '50%' }} />
                     <span>Text Files</span>
                 </div>
-                <div style={{ ...legendItem, marginBottom: 0 }}>
+                <div style={legendItem}>
                     <div style={{ width: 12, height: 12, background: '#10b981', borderRadius: '50%' }} />
                     <span>Concepts/Tags</span>
                 </div>
+                <div style={{ ...legendItem, marginBottom: 0 }}>
+                    <div style={{ width: 14, height: 14, background: '#8b5cf6', borderRadius: '50%' }} />
+                    <span>Clusters (click to expand)</span>
+                </div>
             </div>
         </div>
     );